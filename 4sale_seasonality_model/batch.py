@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from forecasting import ARIMA_WORKERS, WEEKLY_SERIES, arima_revenue_index, cached_fits, weekly_models
+from info import calculate_summary, calculate_yearly_totals
+from kernel import granularity_table, observed_buckets, observed_categories, week_series
+from model_cache import series_digest
+from seasonality import fast_revenue_index, index_growth, revenue_growth
+from sketches import USER_COUNTS
+from sources import fetch_sources
+from warehouse import open_dataset
+
+# Page name -> calendar key of every seasonality table the dashboard shows
+GRANULARITIES = {
+    "monthly": "month",
+    "weekly": "week",
+    "daily": "day",
+    "weekly_month": "week_of_month",
+    "hourly": "hour",
+    "weekday": "weekday",
+}
+
+# Pages whose revenue index is the ARIMA one; the others show the ratio to the mean
+ARIMA_INDEX = ["monthly", "daily", "hourly", "weekday"]
+
+# Point the app at a batch output folder to serve it instead of ingesting the sources
+PRECOMPUTED_DIR_ENV = "SEASONALITY_PRECOMPUTED_DIR"
+FORMATS = ["parquet", "csv"]
+MANIFEST_FILE = "manifest.json"
+AGGREGATES_FILE = "aggregates.pkl"
+SKETCHES_FILE = "sketches.pkl"
+
+# Stored fits the pages serve instead of fitting live; a folder from an older batch run
+# may lack some, and the pages fit those live
+ARTIFACTS = ["forecasts", "weekly_components", "weekly_month_forecasts"]
+
+
+def seasonality_table(aggregates, granularity, workers=None):
+    key = GRANULARITIES[granularity]
+    table = granularity_table(aggregates, key)
+
+    # Every granularity gets its ARIMA fits, for the forecasts if not for the index
+    table["arima_index"], report = arima_revenue_index(table, granularity, workers)
+    if granularity in ARIMA_INDEX:
+        table["revenue_index"] = table["arima_index"]
+    else:
+        table["revenue_index"] = fast_revenue_index(table, key, "Ratio to mean")
+    table["growth%"] = revenue_growth(table) if granularity == "monthly" else index_growth(table["revenue_index"])
+    return table, report
+
+
+def forecast_table(granularity, report):
+    rows = [
+        {"Level-1": level, "granularity": granularity, "step": step, "forecast": value}
+        for level, forecast in report["forecasts"].items()
+        for step, value in enumerate(forecast, start=1)
+    ]
+    return pd.DataFrame(rows, columns=["Level-1", "granularity", "step", "forecast"])
+
+
+def weekly_components(components):
+    # Long format, one row per (week, category), like the granularity tables
+    if components is None:
+        return pd.DataFrame(columns=["week_start", "Level-1", "trend", "seasonal", "resid"])
+    trend = components["trend"]
+    index = pd.MultiIndex.from_product([trend.index, trend.columns])
+    return pd.DataFrame({name: part.to_numpy().ravel() for name, part in components.items()}, index=index).reset_index()
+
+
+def weekly_month_forecasts(aggregates, workers=None):
+    # The weekly-in-month page fits the revenue of the picked category and month summed over
+    # the breakdown; every pick down to one Level-1 is fitted here, keyed by its input
+    picks, names, series = [], [], []
+    for path in [[]] + [[level] for level in observed_categories(aggregates)]:
+        category = {"depth": len(path) + 1, "path": path}
+        for month in ["All"] + list(observed_buckets(aggregates, "month", category)):
+            table = granularity_table(aggregates, "week_of_month", category, month)
+            picks.append((path[0] if path else "All", str(month)))
+            names.append((tuple(path), str(month)))
+            series.append(table.groupby("week_of_month")["revenue"].sum().to_numpy(dtype=np.float64))
+
+    outcomes, _ = cached_fits(series, "weekly_month", workers, names)
+    rows = [
+        {"Level-1": level, "month": month, "input": series_digest(values), "step": step, "forecast": value}
+        for (level, month), values, (fit, error) in zip(picks, series, outcomes) if error is None
+        for step, value in enumerate(fit["forecast"], start=1)
+    ]
+    return pd.DataFrame(rows, columns=["Level-1", "month", "input", "step", "forecast"])
+
+
+def precompute(dataset, workers=None):
+    aggregates = dataset["aggregates"]
+
+    # Threads only orchestrate: the fits of all six granularities and of the weekly series
+    # queue on the shared process pool
+    with ThreadPoolExecutor(max_workers=len(GRANULARITIES) + 2) as executor:
+        weekly = executor.submit(lambda: weekly_models(week_series(aggregates), workers))
+        weekly_month = executor.submit(weekly_month_forecasts, aggregates, workers)
+        results = dict(zip(GRANULARITIES, executor.map(
+            lambda granularity: seasonality_table(aggregates, granularity, workers), GRANULARITIES
+        )))
+    reports = {granularity: report for granularity, (_, report) in results.items()}
+    components, _, reports[WEEKLY_SERIES] = weekly.result()
+
+    # The out-of-core backend has no row-level frame, only the summaries its scans produced
+    final_data = dataset["final_data"]
+    if final_data is None:
+        summary, yearly_totals, levels = dataset["summary"], dataset["yearly_totals"], dataset["levels"]
+    else:
+        exact_users = USER_COUNTS != "approximate"
+        summary, yearly_totals = calculate_summary(final_data, exact_users), calculate_yearly_totals(final_data, exact_users)
+        levels = final_data["Level-1"].dropna().unique()
+    return {
+        "tables": {granularity: table for granularity, (table, _) in results.items()},
+        "forecasts": pd.concat(
+            [forecast_table(granularity, report) for granularity, report in reports.items()],
+            ignore_index=True,
+        ),
+        "weekly_components": weekly_components(components),
+        "weekly_month_forecasts": weekly_month.result(),
+        "failures": {
+            granularity: {str(level): error for level, error in report["failures"].items()}
+            for granularity, report in reports.items()
+        },
+        "summary": summary,
+        "yearly_totals": yearly_totals,
+        "levels": [str(level) for level in levels],
+    }
+
+
+def table_file(name, fmt):
+    return f"{name}.{fmt}"
+
+
+def write_table(frame, directory, name, fmt):
+    path = os.path.join(directory, table_file(name, fmt))
+    if fmt == "csv":
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_parquet(path, index=False)
+
+
+def read_table(directory, name, fmt):
+    path = os.path.join(directory, table_file(name, fmt))
+    return pd.read_csv(path) if fmt == "csv" else pd.read_parquet(path)
+
+
+def write_results(results, dataset, directory, fmt="parquet"):
+    os.makedirs(directory, exist_ok=True)
+    for granularity, table in results["tables"].items():
+        write_table(table, directory, granularity, fmt)
+    for name in ARTIFACTS + ["summary", "yearly_totals"]:
+        write_table(results[name], directory, name, fmt)
+    write_table(dataset["cube"], directory, "cube", fmt)
+    for name, value in ((AGGREGATES_FILE, dataset["aggregates"]), (SKETCHES_FILE, dataset["sketches"])):
+        with open(os.path.join(directory, name), "wb") as handle:
+            pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Written last, so a folder without a manifest is never served half-written
+    manifest = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "format": fmt,
+        "key": dataset["stats"]["key"],
+        "rows": dataset["stats"]["rows"],
+        "invalid_timestamps": dataset["stats"]["invalid_timestamps"],
+        "bad_rows": dataset["stats"]["bad_rows"],
+        "granularities": list(results["tables"]),
+        "levels": results["levels"],
+        "failures": results["failures"],
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as handle:
+        json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+def manifest_version(directory):
+    return os.stat(os.path.join(directory, MANIFEST_FILE)).st_mtime_ns
+
+
+def load_precomputed(directory):
+    start = time.perf_counter()
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No precomputed results found in {directory}; run batch.py first.")
+    with open(path) as handle:
+        manifest = json.load(handle)
+
+    fmt = manifest["format"]
+    with open(os.path.join(directory, AGGREGATES_FILE), "rb") as handle:
+        aggregates = pickle.load(handle)
+    with open(os.path.join(directory, SKETCHES_FILE), "rb") as handle:
+        sketches = pickle.load(handle)
+    artifacts = {
+        name: read_table(directory, name, fmt) if os.path.exists(os.path.join(directory, table_file(name, fmt))) else None
+        for name in ARTIFACTS
+    }
+    return {
+        "tables": {granularity: read_table(directory, granularity, fmt) for granularity in manifest["granularities"]},
+        **artifacts,
+        "failures": manifest["failures"],
+        "summary": read_table(directory, "summary", fmt),
+        "yearly_totals": read_table(directory, "yearly_totals", fmt),
+        "cube": read_table(directory, "cube", fmt),
+        "aggregates": aggregates,
+        "sketches": sketches,
+        "levels": manifest["levels"],
+        "stats": {
+            "mode": "precomputed",
+            "rows": manifest["rows"],
+            "created": manifest["created"],
+            "seconds": time.perf_counter() - start,
+            "invalid_timestamps": manifest["invalid_timestamps"],
+            "bad_rows": manifest["bad_rows"],
+            "key": manifest["key"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute every seasonality table and ARIMA forecast.")
+    parser.add_argument("--output-dir", default=os.environ.get(PRECOMPUTED_DIR_ENV, "precomputed"),
+                        help="folder the tables, forecasts and manifest are written to")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--workers", type=int, default=ARIMA_WORKERS,
+                        help="processes used for the ARIMA fits")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dataset = open_dataset(*fetch_sources())
+    print(f"Loaded {dataset['stats']['rows']:,} rows ({dataset['stats']['mode']}) in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    results = precompute(dataset, args.workers)
+    manifest = write_results(results, dataset, args.output_dir, args.format)
+    print(f"Precomputed {len(manifest['granularities'])} granularities in {time.perf_counter() - start:.1f}s -> {args.output_dir}")
+    for granularity, failures in manifest["failures"].items():
+        for level, error in failures.items():
+            print(f"ARIMA failed for {granularity} / {level}: {error}")
+
+
+if __name__ == "__main__":
+    pd.set_option("mode.copy_on_write", True)
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from batch import ARIMA_INDEX, GRANULARITIES
+from categories import load_category_tree
+from cube import build_cube
+from data_processing import CSV_READER, ingest_transactions
+from forecasting import ARIMA_WORKERS, _fit_or_error, map_fits
+from info import calculate_summary, calculate_yearly_totals
+from kernel import BUCKET_SIZES, aggregate_listings, category_totals, granularity_table, observed_days
+from profiling import current_rss
+from seasonality import fast_revenue_index, index_growth, revenue_growth
+from sketches import approximate_users, build_sketches
+from sources import LISTINGS_FILE, SOURCE_DIR_ENV, TRANSACTIONS_FILE
+from synthetic import SIZES, generate
+
+RESULTS_FILE = "benchmark-results.json"
+
+# How often the resident set size is sampled while a stage runs
+RSS_INTERVAL = 0.01
+
+
+def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def groupby_tables(final_data):
+    # The per-page path: every page filtered the raw rows and ran its own groupby
+    tables = {}
+    for key in BUCKET_SIZES:
+        listings = final_data[final_data["TRANSACTION_TYPE"] == "Listing"]
+        tables[key] = listings.groupby(["Level-1", key], observed=True).agg(
+            revenue=("PRICE", "sum"),
+            listings=("TRANSCATION_ID", "count")
+        ).reset_index()
+    return tables
+
+
+def kernel_tables(final_data, tree):
+    aggregates = aggregate_listings(final_data, tree)
+    return {key: granularity_table(aggregates, key) for key in BUCKET_SIZES}
+
+
+def compare_tables(expected, actual):
+    mismatches = []
+    for key in BUCKET_SIZES:
+        left, right = expected[key], actual[key]
+        # Cells and listing counts are integers and must match exactly
+        same_cells = (
+            len(left) == len(right)
+            and np.array_equal(left["Level-1"].astype(str), right["Level-1"].astype(str))
+            and np.array_equal(left[key].astype(np.int64), right[key].astype(np.int64))
+            and np.array_equal(left["listings"].astype(np.int64), right["listings"].astype(np.int64))
+        )
+        # Revenue is the one float: the groupby sums the float32 PRICE column into a float32
+        # result, the kernel accumulates it in float64, so the two differ by float32 rounding
+        same_revenue = same_cells and np.allclose(left["revenue"], right["revenue"], rtol=1e-6)
+        if not same_revenue:
+            mismatches.append(key)
+    return mismatches
+
+
+def bench_aggregation(final_data, tree):
+    expected, groupby_seconds = timed(groupby_tables, final_data)
+    actual, kernel_seconds = timed(kernel_tables, final_data, tree)
+    return {
+        "rows": len(final_data),
+        "groupby_seconds": groupby_seconds,
+        "kernel_seconds": kernel_seconds,
+        "speedup": groupby_seconds / kernel_seconds if kernel_seconds else float("inf"),
+        "mismatches": compare_tables(expected, actual),
+    }
+
+
+def measure(function, *args):
+    # A sampling thread tracks the peak resident set size while the stage runs
+    baseline = current_rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_INTERVAL):
+            peak[0] = max(peak[0], current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    peak[0] = max(peak[0], current_rss())
+    return result, {
+        "seconds": seconds,
+        "peak_rss_mb": peak[0] / 2**20,
+        "peak_delta_mb": (peak[0] - baseline) / 2**20,
+    }
+
+
+def page_table(aggregates, granularity):
+    # The page-side work without the ARIMA fits: table, index and growth%
+    key = GRANULARITIES[granularity]
+    table = granularity_table(aggregates, key)
+    table["revenue_index"] = fast_revenue_index(table, key, "Ratio to mean")
+    table["growth%"] = revenue_growth(table) if granularity == "monthly" else index_growth(table["revenue_index"])
+    return table
+
+
+def level_series(table):
+    return [
+        group["revenue"].fillna(0).to_numpy(dtype=np.float64)
+        for _, group in table.groupby("Level-1", observed=True, sort=False)
+    ]
+
+
+def arima_loop(series, workers, starts=None):
+    # Fits straight through the pool, bypassing the model cache so every run does the work
+    return map_fits(_fit_or_error, series, workers, starts)
+
+
+def add_stage(stages, name, rows, stage):
+    stage["rows"] = rows
+    stage["rows_per_second"] = rows / stage["seconds"] if stage["seconds"] > 0 else float("inf")
+    stages[name] = stage
+    print(f"{name:<24} {stage['seconds']:>9.3f}s {stage['rows_per_second']:>14,.0f} rows/s "
+          f"peak {stage['peak_rss_mb']:,.0f} MB (+{stage['peak_delta_mb']:,.0f})", flush=True)
+
+
+def run_stages(transactions_path, listings_path, workers, arima=True):
+    stages = {}
+    (final_data, _), stage = measure(ingest_transactions, transactions_path, listings_path)
+    rows = len(final_data)
+    add_stage(stages, "ingest", rows, stage)
+
+    _, stage = measure(build_cube, final_data)
+    add_stage(stages, "cube", rows, stage)
+    tree, stage = measure(load_category_tree, listings_path)
+    add_stage(stages, "category_tree", len(tree["labels"][-1]), stage)
+    aggregates, stage = measure(aggregate_listings, final_data, tree)
+    add_stage(stages, "aggregates", rows, stage)
+    for depth in (2, 3):
+        _, stage = measure(granularity_table, aggregates, "month", {"depth": depth, "path": []})
+        add_stage(stages, f"drill:level-{depth}", rows, stage)
+    # A date range is answered from the running totals, one subtraction per run of days in a bucket
+    bounds = observed_days(aggregates)
+    if bounds is not None:
+        period = {"start": bounds[0], "end": bounds[1], "yoy": False}
+        for key in ("month", "day"):
+            _, stage = measure(granularity_table, aggregates, key, {"depth": 3, "path": []}, "All", period)
+            add_stage(stages, f"range:{key}", rows, stage)
+        _, stage = measure(category_totals, aggregates, {"depth": 3, "path": []}, period)
+        add_stage(stages, "range:totals", rows, stage)
+    for granularity in GRANULARITIES:
+        _, stage = measure(page_table, aggregates, granularity)
+        add_stage(stages, f"page:{granularity}", rows, stage)
+    for name, function in [("calculate_summary", calculate_summary), ("yearly_totals", calculate_yearly_totals)]:
+        _, stage = measure(function, final_data)
+        add_stage(stages, f"info:{name}", rows, stage)
+    # The approximate user counts: one hashing pass, then merges of the monthly sketches
+    sketches, stage = measure(build_sketches, final_data)
+    add_stage(stages, "info:sketches", rows, stage)
+    for name, keys in [("approx_summary", ["year", "month"]), ("approx_yearly", ["year"])]:
+        _, stage = measure(approximate_users, sketches, keys)
+        add_stage(stages, f"info:{name}", rows, stage)
+
+    if arima:
+        # The first ARIMA stage also pays for spawning the worker pool, as the first page view does
+        for granularity in ARIMA_INDEX:
+            table = granularity_table(aggregates, GRANULARITIES[granularity])
+            series = level_series(table)
+            results, stage = measure(arima_loop, series, workers)
+            # rows here are the points fitted across every Level-1 series
+            add_stage(stages, f"arima:{granularity}", len(table), stage)
+            # A refresh: the same fits again, started from the parameters just estimated
+            starts = [fit["params"] if error is None else None for fit, error in results]
+            _, stage = measure(arima_loop, series, workers, starts)
+            add_stage(stages, f"arima-refit:{granularity}", len(table), stage)
+    return final_data, tree, stages
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_results(path, record):
+    # One record per run, so results from different commits can be compared side by side
+    runs = []
+    if os.path.exists(path):
+        with open(path) as handle:
+            runs = json.load(handle)
+    runs.append(record)
+    with open(path, "w") as handle:
+        json.dump(runs, handle, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, aggregation and model stages.")
+    parser.add_argument("--source-dir", default=os.environ.get(SOURCE_DIR_ENV, "."),
+                        help="folder holding transactions.csv and listingsCategories.csv")
+    parser.add_argument("--synthetic", choices=list(SIZES),
+                        help="benchmark generated data of this size instead of --source-dir")
+    parser.add_argument("--data-dir", default=os.path.join(".seasonality_cache", "synthetic"),
+                        help="folder the synthetic CSVs are generated into and reused from")
+    parser.add_argument("--output", default=RESULTS_FILE, help="JSON file the results are appended to")
+    parser.add_argument("--workers", type=int, default=ARIMA_WORKERS, help="processes used for the ARIMA fits")
+    parser.add_argument("--skip-arima", action="store_true", help="leave out the ARIMA stages")
+    parser.add_argument("--skip-check", action="store_true", help="leave out the groupby vs kernel comparison")
+    args = parser.parse_args()
+
+    source_dir = args.source_dir
+    if args.synthetic:
+        source_dir = os.path.join(args.data_dir, args.synthetic)
+        if not os.path.exists(os.path.join(source_dir, TRANSACTIONS_FILE)):
+            print(f"Generating {SIZES[args.synthetic]:,} synthetic rows in {source_dir}", flush=True)
+            generate(SIZES[args.synthetic], source_dir)
+
+    final_data, tree, stages = run_stages(
+        os.path.join(source_dir, TRANSACTIONS_FILE), os.path.join(source_dir, LISTINGS_FILE),
+        args.workers, arima=not args.skip_arima,
+    )
+
+    check = None
+    if not args.skip_check:
+        check = bench_aggregation(final_data, tree)
+        print(
+            f"{check['rows']:,} rows: per-page groupby {check['groupby_seconds']:.3f}s, "
+            f"bincount kernel {check['kernel_seconds']:.3f}s ({check['speedup']:.1f}x)"
+        )
+
+    append_results(args.output, {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "source": args.synthetic or source_dir,
+        "rows": len(final_data),
+        "workers": args.workers,
+        "csv_reader": CSV_READER,
+        "stages": stages,
+        "aggregation_check": check,
+    })
+    print(f"Results appended to {args.output}")
+
+    if check and check["mismatches"]:
+        raise SystemExit(f"Kernel tables differ from groupby tables for: {', '.join(check['mismatches'])}")
+
+
+if __name__ == "__main__":
+    pd.set_option("mode.copy_on_write", True)
+    main()
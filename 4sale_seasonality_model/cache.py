@@ -0,0 +1,349 @@
+import functools
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import Counter
+
+import pandas as pd
+
+from categories import load_category_tree
+from cube import build_cube, merge_cubes
+from data_processing import CSV_READER, TIMESTAMP_FORMAT, append_rows, ingest_transactions
+from kernel import aggregate_listings, merge_aggregates
+from partitions import partition_index, sort_partitions
+from sketches import PRECISION, build_sketches, merge_sketches
+
+CACHE_DIR = os.environ.get("SEASONALITY_CACHE_DIR", ".seasonality_cache")
+DATASET_DIR = os.path.join(CACHE_DIR, "dataset")
+
+# Bump whenever the enriched frame layout changes so stale files are ignored
+CACHE_VERSION = "11"
+
+# Append new export rows past the stored watermark instead of rebuilding everything
+INCREMENTAL = os.environ.get("SEASONALITY_INCREMENTAL", "1") != "0"
+
+# Appended parts are compacted into one file once there are more than this
+MAX_PARTS = 32
+
+# Rows the arrow reader could not parse, with the error that sent them here
+QUARANTINE_PATH = os.path.join(CACHE_DIR, "quarantine.csv")
+
+# Size, mtime and digest of each source, so a restart only re-hashes a file that changed
+DIGESTS_PATH = os.path.join(CACHE_DIR, "digests.json")
+
+# A different reader or timestamp format can keep different rows, so it needs a rebuild
+READER_SETTINGS = {"reader": CSV_READER, "timestamp_format": TIMESTAMP_FORMAT}
+
+
+def file_digest(path):
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+_digests_lock = threading.Lock()
+
+
+# Size and mtime are part of the key so an unchanged file is hashed only once
+@functools.lru_cache(maxsize=16)
+def _file_digest(path, size, mtime_ns, block_size=1 << 20):
+    entry = read_digests().get(path)
+    if entry and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+        return entry["sha256"]
+    digest = prefix_digest(path, size, block_size)
+    if digest is not None:
+        record_digest(path, {"size": size, "mtime_ns": mtime_ns, "sha256": digest})
+    return digest
+
+
+def read_digests():
+    try:
+        with open(DIGESTS_PATH) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_digest(path, entry):
+    def write(tmp):
+        with open(tmp, "w") as handle:
+            json.dump(digests, handle)
+
+    # The downloads hash both sources on their own threads, so the read-modify-write is locked
+    with _digests_lock:
+        digests = {name: item for name, item in read_digests().items() if os.path.exists(name)}
+        digests[path] = entry
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        replace_file(DIGESTS_PATH, write)
+
+
+def prefix_digest(path, length, block_size=1 << 20):
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, "rb") as handle:
+        while remaining:
+            block = handle.read(min(block_size, remaining))
+            if not block:
+                return None
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def source_key(transactions_path, listings_path):
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    digest.update(file_digest(transactions_path).encode())
+    digest.update(file_digest(listings_path).encode())
+    return digest.hexdigest()[:32]
+
+
+def dataset_path(name):
+    return os.path.join(DATASET_DIR, name)
+
+
+def replace_file(path, write):
+    # Write to a temporary file first so a crash never leaves a truncated cache
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_manifest():
+    try:
+        with open(dataset_path("manifest.json")) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == CACHE_VERSION else None
+
+
+def write_manifest(manifest):
+    def write(tmp):
+        with open(tmp, "w") as handle:
+            json.dump(manifest, handle)
+
+    replace_file(dataset_path("manifest.json"), write)
+
+
+def read_dataset(manifest):
+    parts = [pd.read_parquet(dataset_path(name)) for name in manifest["parts"]]
+    final_data = parts[0]
+    for part in parts[1:]:
+        final_data = append_rows(final_data, part)
+
+    cube = pd.read_parquet(dataset_path(manifest["cube"]))
+    with open(dataset_path(manifest["aggregates"]), "rb") as handle:
+        aggregates = pickle.load(handle)
+    with open(dataset_path(manifest["sketches"]), "rb") as handle:
+        sketches = pickle.load(handle)
+    return final_data, cube, aggregates, sketches
+
+
+def write_part(frame, index):
+    name = f"part-{index:05d}.parquet"
+    replace_file(dataset_path(name), lambda tmp: frame.to_parquet(tmp, index=False))
+    return name
+
+
+def write_pickle(name, value):
+    def write(tmp):
+        with open(tmp, "wb") as handle:
+            pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    replace_file(dataset_path(name), write)
+    return name
+
+
+def write_aggregates(cube, aggregates, sketches, index):
+    cube_name = f"cube-{index:05d}.parquet"
+    replace_file(dataset_path(cube_name), lambda tmp: cube.to_parquet(tmp, index=False))
+    return {
+        "cube": cube_name,
+        "aggregates": write_pickle(f"aggregates-{index:05d}.pkl", aggregates),
+        "sketches": write_pickle(f"sketches-{index:05d}.pkl", sketches),
+    }
+
+
+def prune(manifest):
+    # Runs after the manifest is replaced, so a crash never orphans a file it still needs
+    keep = set(manifest["parts"]) | {manifest["cube"], manifest["aggregates"], manifest["sketches"], "manifest.json"}
+    for name in os.listdir(DATASET_DIR):
+        if name not in keep:
+            os.remove(dataset_path(name))
+
+
+def watermark(final_data, previous=None):
+    latest = final_data["TIMESTAMP"].max()
+    # Ids are nullable integers; a missing one cannot be matched later and is not valid JSON
+    ids = final_data.loc[final_data["TIMESTAMP"] == latest, "TRANSCATION_ID"].dropna().astype("int64").tolist()
+    if previous is not None and pd.Timestamp(previous["watermark"]) == latest:
+        ids = sorted(set(ids) | set(previous["watermark_ids"]))
+    return latest.isoformat(), ids
+
+
+def past_watermark(rows, manifest):
+    latest = pd.Timestamp(manifest["watermark"])
+    newer = rows["TIMESTAMP"] > latest
+    same = (rows["TIMESTAMP"] == latest) & ~rows["TRANSCATION_ID"].isin(manifest["watermark_ids"])
+    return rows[newer | same].reset_index(drop=True)
+
+
+def new_manifest(key, transactions_path, listings_path, files, next_part, final_data, bad_rows, invalid_timestamps, previous=None):
+    latest, ids = watermark(final_data, previous)
+    return {
+        **files,
+        "version": CACHE_VERSION,
+        "key": key,
+        "listings_digest": file_digest(listings_path),
+        "transactions_digest": file_digest(transactions_path),
+        "transactions_bytes": os.path.getsize(transactions_path),
+        "watermark": latest,
+        "watermark_ids": ids,
+        "next_part": next_part,
+        "invalid_timestamps": invalid_timestamps,
+        "bad_rows": bad_rows,
+        "reader": READER_SETTINGS,
+    }
+
+
+def restart_quarantine():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if os.path.exists(QUARANTINE_PATH):
+        os.remove(QUARANTINE_PATH)
+
+
+def full_rebuild(key, transactions_path, listings_path):
+    restart_quarantine()
+    final_data, stats = ingest_transactions(transactions_path, listings_path, quarantine_path=QUARANTINE_PATH)
+    cube = build_cube(final_data)
+    aggregates = aggregate_listings(final_data, load_category_tree(listings_path), partition_index(final_data))
+    sketches = build_sketches(final_data)
+
+    shutil.rmtree(DATASET_DIR, ignore_errors=True)
+    os.makedirs(DATASET_DIR)
+    files = dict(write_aggregates(cube, aggregates, sketches, 0), parts=[write_part(final_data, 0)])
+    write_manifest(new_manifest(
+        key, transactions_path, listings_path, files, 1, final_data, stats["bad_rows"], stats["invalid_timestamps"]
+    ))
+    return final_data, cube, aggregates, sketches, dict(stats, mode="full")
+
+
+def appended_tail(transactions_path, manifest):
+    # When the new export only appends to the old one, parse just the new bytes
+    offset = manifest["transactions_bytes"]
+    if os.path.getsize(transactions_path) < offset:
+        return None, None
+    if prefix_digest(transactions_path, offset) != manifest["transactions_digest"]:
+        return None, None
+    with open(transactions_path, "rb") as handle:
+        header = handle.readline()
+        handle.seek(offset - 1)
+        if handle.read(1) != b"\n":
+            return None, None
+        return header, handle.read()
+
+
+def incremental_update(manifest, key, transactions_path, listings_path):
+    start = time.perf_counter()
+    final_data, cube, aggregates, sketches = current_sketches(*read_dataset(manifest))
+
+    header, body = appended_tail(transactions_path, manifest)
+    if body is None:
+        # Rewritten export: parse it all, but still only append rows past the watermark
+        source = transactions_path
+    elif body.strip():
+        source = io.BytesIO(header + body)
+    else:
+        source = None
+
+    new_rows = None
+    bad_rows, invalid_timestamps = manifest["bad_rows"], manifest["invalid_timestamps"]
+    if source is not None:
+        # A rewritten export is parsed whole, so its bad rows replace the stored ones
+        if body is None:
+            restart_quarantine()
+        new_rows, stats = ingest_transactions(source, listings_path, quarantine_path=QUARANTINE_PATH)
+        new_rows = past_watermark(new_rows, manifest)
+        if body is None:
+            bad_rows, invalid_timestamps = stats["bad_rows"], stats["invalid_timestamps"]
+        else:
+            bad_rows = dict(Counter(bad_rows) + Counter(stats["bad_rows"]))
+            invalid_timestamps += stats["invalid_timestamps"]
+
+    files = {name: manifest[name] for name in ("parts", "cube", "aggregates", "sketches")}
+    next_part = manifest["next_part"]
+    if new_rows is not None and len(new_rows):
+        # The listings are unchanged on this path, so the stored category tree still applies
+        delta_aggregates = aggregate_listings(new_rows, aggregates["tree"], partition_index(new_rows))
+        final_data = append_rows(final_data, new_rows)
+        cube = merge_cubes(cube, build_cube(new_rows))
+        aggregates = merge_aggregates(aggregates, delta_aggregates)
+        # Sketches are mergeable too: only the new rows are hashed
+        sketches = merge_sketches(sketches, build_sketches(new_rows))
+        if len(files["parts"]) >= MAX_PARTS:
+            parts = [write_part(sort_partitions(final_data), next_part)]
+        else:
+            parts = files["parts"] + [write_part(new_rows, next_part)]
+        files = dict(write_aggregates(cube, aggregates, sketches, next_part), parts=parts)
+        next_part += 1
+
+    manifest = new_manifest(
+        key, transactions_path, listings_path, files, next_part, final_data, bad_rows, invalid_timestamps, manifest
+    )
+    write_manifest(manifest)
+    prune(manifest)
+    elapsed = time.perf_counter() - start
+    stats = {
+        "mode": "incremental",
+        "rows": len(final_data),
+        "new_rows": 0 if new_rows is None else len(new_rows),
+        "seconds": elapsed,
+        "invalid_timestamps": invalid_timestamps,
+        "bad_rows": bad_rows,
+    }
+    return final_data, cube, aggregates, sketches, stats
+
+
+def current_sketches(final_data, cube, aggregates, sketches):
+    # A changed SEASONALITY_HLL_PRECISION only needs the sketches rebuilt, not the dataset
+    if sketches["precision"] != PRECISION:
+        sketches = build_sketches(final_data)
+    return final_data, cube, aggregates, sketches
+
+
+def load_dataset(transactions_path, listings_path):
+    key = source_key(transactions_path, listings_path)
+    manifest = read_manifest()
+
+    start = time.perf_counter()
+    if manifest is not None and manifest["reader"] != READER_SETTINGS:
+        manifest = None
+    if manifest is not None and manifest["key"] == key:
+        final_data, cube, aggregates, sketches = current_sketches(*read_dataset(manifest))
+        stats = {
+            "mode": "cached",
+            "rows": len(final_data),
+            "seconds": time.perf_counter() - start,
+            "invalid_timestamps": manifest["invalid_timestamps"],
+            "bad_rows": manifest["bad_rows"],
+        }
+    elif INCREMENTAL and manifest is not None and manifest["listings_digest"] == file_digest(listings_path):
+        final_data, cube, aggregates, sketches, stats = incremental_update(manifest, key, transactions_path, listings_path)
+    else:
+        # First run, or the category mapping changed: rebuild from scratch
+        final_data, cube, aggregates, sketches, stats = full_rebuild(key, transactions_path, listings_path)
+
+    # Appended parts are each sorted on their own; the combined frame is put back in partition order
+    final_data = sort_partitions(final_data)
+    return {
+        "final_data": final_data,
+        "partitions": partition_index(final_data),
+        "cube": cube,
+        "aggregates": aggregates,
+        "sketches": sketches,
+        "stats": dict(stats, key=key),
+    }
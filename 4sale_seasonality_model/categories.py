@@ -0,0 +1,78 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_processing import LEVEL_SEPARATOR, load_listings
+from kernel import LEVEL_COLUMNS, observed_categories
+
+
+def split_levels(listings):
+    # One split per category row; paths shorter than three levels repeat their deepest name
+    segments = listings["FULL_PATH"].str.split(LEVEL_SEPARATOR)
+    names = {"Level-1": listings["Level-1"]}
+    for depth, column in enumerate(LEVEL_COLUMNS[1:], start=1):
+        name = segments.str[depth].str.replace("--_--", "").str.strip()
+        names[column] = name.mask(name == "").fillna(names[LEVEL_COLUMNS[depth - 1]])
+    return pd.DataFrame(names)
+
+
+def node_labels(nodes):
+    # A name shared by nodes under different parents is shown with its full path
+    counts = Counter(node[-1] for node in nodes)
+    return pd.Index([node[-1] if counts[node[-1]] == 1 else " > ".join(node) for node in nodes])
+
+
+def build_category_tree(listings):
+    cat_ids = pd.to_numeric(listings["CAT_ID"], errors="coerce")
+    valid = cat_ids.notna() & (cat_ids >= 0) & listings["Level-1"].notna()
+    cat_ids = cat_ids[valid].astype(np.int64).to_numpy()
+    paths = list(split_levels(listings[valid]).itertuples(index=False, name=None))
+
+    # Leaves sorted by path put every node's leaves in one contiguous run
+    leaves = sorted(set(paths))
+    leaf_index = {path: code for code, path in enumerate(leaves)}
+    labels, ancestors = [], []
+    for depth in range(1, len(LEVEL_COLUMNS) + 1):
+        prefixes = [leaf[:depth] for leaf in leaves]
+        nodes = sorted(set(prefixes))
+        node_index = {node: code for code, node in enumerate(nodes)}
+        labels.append(node_labels(nodes))
+        ancestors.append(np.array([node_index[prefix] for prefix in prefixes], dtype=np.int64))
+
+    # Dense CAT_ID -> node code at every level, -1 marks an unknown category
+    codes = np.full((len(LEVEL_COLUMNS), cat_ids.max() + 1 if len(cat_ids) else 0), -1, dtype=np.int32)
+    cat_leaves = np.array([leaf_index[path] for path in paths], dtype=np.int64)
+    for depth, node_codes in enumerate(ancestors):
+        codes[depth, cat_ids] = node_codes[cat_leaves]
+    return {"labels": labels, "ancestors": ancestors, "codes": codes}
+
+
+def load_category_tree(listings_path):
+    return build_category_tree(load_listings(listings_path))
+
+
+def category_selector(aggregates):
+    level = st.sidebar.selectbox("Break down by", options=LEVEL_COLUMNS, key="category_depth")
+    depth = LEVEL_COLUMNS.index(level) + 1
+
+    # Each pick narrows the next selector to its children; "All" stops the drill-down there
+    path = []
+    for column in LEVEL_COLUMNS[:depth]:
+        choice = st.sidebar.selectbox(
+            f"Select {column} Category", options=["All"] + observed_categories(aggregates, path), key=f"category_{column}"
+        )
+        if choice == "All":
+            break
+        path.append(choice)
+    return {"depth": depth, "path": path}
+
+
+def selected_category(category):
+    # The one category the page's single-series analysis runs on, if the picks reach the breakdown level
+    return category["path"][-1] if len(category["path"]) == category["depth"] else "All"
+
+
+def selected_level_1(category):
+    return category["path"][0] if category["path"] else "All"
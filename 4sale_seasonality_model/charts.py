@@ -0,0 +1,109 @@
+import hashlib
+import io
+import os
+
+import altair as alt
+import pandas as pd
+import seaborn as sns
+import streamlit as st
+from matplotlib.figure import Figure
+
+# "auto" switches large heatmaps to the interactive backend; "static" and "interactive" force one
+CHART_BACKEND = os.environ.get("SEASONALITY_CHART_BACKEND", "auto")
+INTERACTIVE_CELLS = int(os.environ.get("SEASONALITY_INTERACTIVE_CELLS", "600"))
+
+# Rendered images kept per server process; one chart is a few hundred KB of PNG
+CHART_CACHE_ENTRIES = 256
+
+# st.pyplot saves at 200 dpi, but st.image re-encodes anything wider than its
+# 1460px content width on every rerun; rendering to fit lets cached bytes pass through
+MAX_WIDTH_PX = 1400
+MAX_DPI = 200
+
+
+def frame_digest(data):
+    hasher = hashlib.sha256()
+    hasher.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    labels = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+    hasher.update(repr((labels, data.index.name, str(data.dtypes))).encode())
+    return hasher.hexdigest()
+
+
+def _to_png(figure):
+    buffer = io.BytesIO()
+    dpi = min(MAX_DPI, MAX_WIDTH_PX / figure.get_figwidth())
+    figure.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+# A bare Figure is never registered with pyplot, so it is freed as soon as
+# the PNG is written instead of piling up in the server process.
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def _heatmap_png(digest, _data, options):
+    options = dict(options)
+    figure = Figure(figsize=options["figsize"])
+    ax = figure.subplots()
+    cbar_kws = {"label": options["cbar_label"]} if options["cbar_label"] else None
+    sns.heatmap(_data, ax=ax, annot=options["annot"], fmt=options["fmt"], cmap=options["cmap"], cbar_kws=cbar_kws)
+    if options["title"]:
+        ax.set_title(options["title"])
+    if options["xlabel"] is not None:
+        ax.set_xlabel(options["xlabel"])
+    if options["ylabel"] is not None:
+        ax.set_ylabel(options["ylabel"])
+    return _to_png(figure)
+
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def _bar_png(digest, _series, options):
+    options = dict(options)
+    figure = Figure(figsize=options["figsize"])
+    ax = figure.subplots()
+    _series.plot(kind="bar", color=options["color"], ax=ax)
+    ax.set_title(options["title"])
+    ax.set_xlabel(options["xlabel"])
+    ax.set_ylabel(options["ylabel"])
+    ax.tick_params(axis="x", labelrotation=options["rotation"])
+    return _to_png(figure)
+
+
+def interactive_heatmap(data, title=None, xlabel=None, ylabel=None, cmap="coolwarm", cbar_label=None):
+    row = data.index.name or "row"
+    column = data.columns.name or "column"
+    value = cbar_label or "value"
+    long = data.rename_axis(index=row, columns=column).reset_index().melt(id_vars=row, value_name=value)
+    long[[row, column]] = long[[row, column]].astype(str)
+    scheme = "blueorange" if cmap == "coolwarm" else "yellowgreenblue"
+    chart = alt.Chart(long).mark_rect().encode(
+        x=alt.X(f"{column}:O", title=xlabel if xlabel is not None else column, sort=list(data.columns.astype(str))),
+        y=alt.Y(f"{row}:O", title=ylabel if ylabel is not None else row, sort=list(data.index.astype(str))),
+        color=alt.Color(f"{value}:Q", scale=alt.Scale(scheme=scheme)),
+        tooltip=[row, column, alt.Tooltip(f"{value}:Q", format=".2f")],
+    )
+    if title:
+        chart = chart.properties(title=title)
+    st.altair_chart(chart, width="stretch")
+
+
+def heatmap(data, title=None, xlabel=None, ylabel=None, figsize=(12, 6), annot=True, fmt=".2f",
+            cmap="coolwarm", cbar_label=None):
+    backend = CHART_BACKEND
+    if backend == "auto":
+        backend = "interactive" if data.size > INTERACTIVE_CELLS else "static"
+    if backend == "interactive":
+        interactive_heatmap(data, title, xlabel, ylabel, cmap, cbar_label)
+        return
+
+    options = (
+        ("title", title), ("xlabel", xlabel), ("ylabel", ylabel), ("figsize", figsize),
+        ("annot", annot), ("fmt", fmt), ("cmap", cmap), ("cbar_label", cbar_label),
+    )
+    st.image(_heatmap_png(frame_digest(data), data, options), width="stretch")
+
+
+def bar_chart(series, title, xlabel, ylabel, figsize=(10, 6), color="skyblue", rotation=45):
+    options = (
+        ("title", title), ("xlabel", xlabel), ("ylabel", ylabel), ("figsize", figsize),
+        ("color", color), ("rotation", rotation),
+    )
+    st.image(_bar_png(frame_digest(series), series, options), width="stretch")
@@ -0,0 +1,44 @@
+import numpy as np
+
+from data_processing import append_rows
+
+# Grain of the seasonality cube. iso_year, week and week_of_month follow from
+# (year, month, day), so carrying them adds no extra cells.
+CUBE_KEYS = [
+    "TRANSACTION_TYPE", "Level-1", "year", "month", "day", "hour", "weekday",
+    "iso_year", "week", "week_of_month",
+]
+
+
+def build_cube(final_data):
+    # Accumulate revenue in float64 even though PRICE is stored as float32
+    prices = final_data[CUBE_KEYS + ["TRANSCATION_ID"]].assign(PRICE=final_data["PRICE"].astype(np.float64))
+    cube = prices.groupby(CUBE_KEYS, observed=True, sort=False).agg(
+        revenue=("PRICE", "sum"),
+        listings=("TRANSCATION_ID", "count")
+    ).reset_index()
+    return cube
+
+
+def select(cube, selected_level_1="All", transaction_type="Listing"):
+    if transaction_type is not None:
+        cube = cube[cube["TRANSACTION_TYPE"] == transaction_type]
+    if selected_level_1 != "All":
+        cube = cube[cube["Level-1"] == selected_level_1]
+    return cube
+
+
+def rollup(cube, keys):
+    return cube.groupby(keys, observed=True).agg(
+        revenue=("revenue", "sum"),
+        listings=("listings", "sum")
+    ).reset_index()
+
+
+def merge_cubes(cube, delta):
+    # Cells are additive, so folding in new rows only costs the size of the cube
+    merged = append_rows(cube, delta)
+    return merged.groupby(CUBE_KEYS, observed=True, sort=False).agg(
+        revenue=("revenue", "sum"),
+        listings=("listings", "sum")
+    ).reset_index()
@@ -1,4 +1,73 @@
+import csv
+import functools
+import logging
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas.tseries.api import guess_datetime_format
+from pyarrow import csv as pa_csv
+
+from partitions import sort_partitions
+from profiling import stage
+
+logger = logging.getLogger(__name__)
+
+LEVEL_SEPARATOR = " --_-- "
+CHUNKSIZE = 100000
+
+# "arrow" streams the transactions CSV block by block, types the blocks against SOURCE_SCHEMA
+# on all cores and quarantines the rows that do not fit it; "pandas" reads in chunks and
+# coerces bad fields to NaN
+CSV_READER = os.environ.get("SEASONALITY_CSV_READER", "arrow")
+# The fast path; timestamps in any other format go through the pandas parser instead
+TIMESTAMP_FORMAT = os.environ.get("SEASONALITY_TIMESTAMP_FORMAT", "%Y-%m-%d %H:%M:%S")
+ARROW_BLOCK_SIZE = 1 << 22
+
+# Threads typing blocks; arrow's compute kernels release the GIL, so they run in parallel
+PARSE_WORKERS = int(os.environ.get("SEASONALITY_PARSE_WORKERS", os.cpu_count() or 1))
+
+# A file where more rows fail than this is read with the wrong settings, not dirty
+MAX_BAD_FRACTION = float(os.environ.get("SEASONALITY_MAX_BAD_FRACTION", "0.5"))
+
+# Declared type of every transactions column, checked in this order; a row is quarantined
+# under the first column it fails
+SOURCE_SCHEMA = {
+    "TIMESTAMP": "timestamp",
+    "TRANSCATION_ID": "integer",
+    "USER_ID": "integer",
+    "CATEGORY_ID": "integer",
+    "PRICE": "float",
+    "TRANSACTION_TYPE": "string",
+}
+# Integers may carry a ".0" from an export that went through floats
+INTEGER_PATTERN = r"^[+-]?\d+(\.0*)?$"
+FLOAT_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+FIELD_COUNT_ERROR = "wrong number of fields"
+
+# Declared storage schema for the enriched frame
+CATEGORY_COLUMNS = ["Level-1", "TRANSACTION_TYPE"]
+INTEGER_COLUMNS = ["TRANSCATION_ID", "USER_ID", "CAT_ID"]
+PRICE_COLUMN = "PRICE"
+
+# Integer calendar keys derived once from TIMESTAMP at ingest
+CALENDAR_COLUMNS = ["year", "month", "iso_year", "week", "day", "week_of_month", "weekday", "hour"]
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# What the "before" figure of the memory report is: the frame as each reader hands it over
+MEMORY_BASELINES = {
+    "arrow": "as read by the arrow reader (typed numbers and timestamps, object strings)",
+    "pandas": "as read by pandas (object strings, including the timestamps)",
+}
+
+# Largest rounding error accepted when storing prices as float32
+PRICE_TOLERANCE = 5e-4
+
 
 def process_uploaded_data(transactions, categories):
     categories['Level-1'] = categories['FULL_PATH'].str.split('--_--').str[0].str.strip()
@@ -12,4 +81,320 @@ def process_uploaded_data(transactions, categories):
     )
 
     enriched_data['TIMESTAMP'] = pd.to_datetime(enriched_data['TIMESTAMP'])
-    return enriched_data
\ No newline at end of file
+    return enriched_data
+
+
+def load_listings(path):
+    stat = os.stat(path)
+    return _parsed_listings(os.path.abspath(path), stat.st_size, stat.st_mtime_ns).copy()
+
+
+# Keyed like the file digests, so listings parsed while the transactions were still
+# downloading are reused by the rebuild; callers get their own copy of the small frame
+@functools.lru_cache(maxsize=4)
+def _parsed_listings(path, size, mtime_ns):
+    listings = pd.read_csv(path, encoding='utf-8', delimiter=',', quotechar='"', on_bad_lines='skip')
+    listings.columns = listings.columns.str.strip()
+    if "FULL_PATH" not in listings.columns:
+        raise ValueError("'FULL_PATH' column not found in listings file.")
+
+    # Split FULL_PATH once per category instead of once per transaction chunk
+    listings["Level-1"] = (
+        listings["FULL_PATH"].str.split(LEVEL_SEPARATOR).str[0].str.replace("--_--", "").str.strip()
+    )
+    return listings
+
+
+def build_level1_lookup(listings):
+    cat_ids = pd.to_numeric(listings["CAT_ID"], errors="coerce")
+    valid = cat_ids.notna() & (cat_ids >= 0)
+    cat_ids = cat_ids[valid].astype(np.int64).to_numpy()
+    codes, levels = pd.factorize(listings.loc[valid, "Level-1"])
+
+    # Dense CAT_ID -> Level-1 code array, -1 marks an unknown category
+    lookup = np.full(cat_ids.max() + 1 if len(cat_ids) else 0, -1, dtype=np.int32)
+    lookup[cat_ids] = codes
+    return lookup, np.asarray(levels, dtype=object)
+
+
+def map_level1(cat_ids, lookup, levels):
+    cat_ids = pd.to_numeric(cat_ids, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    known = ~np.isnan(cat_ids) & (cat_ids >= 0) & (cat_ids < len(lookup))
+    codes = np.full(len(cat_ids), -1, dtype=np.int32)
+    codes[known] = lookup[cat_ids[known].astype(np.int64)]
+
+    # Index -1 picks the trailing None, matching the NaN a left merge produces
+    return np.append(levels, None)[codes]
+
+
+def csv_header(source):
+    # Read without consuming a buffer, so the parser still starts at the header
+    if hasattr(source, "seek"):
+        position = source.tell()
+        line = source.readline()
+        source.seek(position)
+    else:
+        with open(source, "rb") as handle:
+            line = handle.readline()
+    return [name.strip() for name in next(csv.reader([line.decode("utf-8-sig")]), [])]
+
+
+def parse_timestamps(values):
+    # The format is guessed from the first value and parsed vectorized; whatever it misses
+    # is parsed value by value. Offsets are converted to UTC, naive times kept as they are.
+    guess = guess_datetime_format(values.iloc[0])
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns, UTC]")
+    if guess is not None:
+        parsed = pd.to_datetime(values, format=guess, errors="coerce", utc=True)
+    rest = parsed.isna()
+    if rest.any():
+        try:
+            parsed[rest] = pd.to_datetime(values[rest], format="mixed", errors="coerce", utc=True)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return parsed.dt.tz_localize(None).astype("datetime64[ns]")
+
+
+def parse_column(values, kind):
+    # Returns the typed column and, per row, whether the field was missing or unparsable
+    trimmed = pc.utf8_trim_whitespace(values)
+    missing = pc.equal(trimmed, "")
+    if kind == "timestamp":
+        parsed = pc.strptime(trimmed, format=TIMESTAMP_FORMAT, unit="s", error_is_null=True).cast(pa.timestamp("ns"))
+        failed = pc.and_(pc.invert(missing), pc.is_null(parsed)).to_numpy(zero_copy_only=False)
+        if failed.any():
+            # Another export format, or fractional seconds: only those rows pay for the pandas parser
+            values = parsed.to_numpy(zero_copy_only=False)
+            values[failed] = parse_timestamps(pc.filter(trimmed, failed).to_pandas()).to_numpy()
+            parsed = pa.array(values, pa.timestamp("ns"), from_pandas=True)
+        return parsed, missing, pc.and_(pc.invert(missing), pc.is_null(parsed))
+    if kind == "string":
+        return pc.if_else(missing, pa.scalar(None, pa.string()), values), missing, pc.and_(missing, False)
+    pattern, target = (INTEGER_PATTERN, pa.int64()) if kind == "integer" else (FLOAT_PATTERN, pa.float64())
+    try:
+        # A clean column converts in one cast; only a failing one pays for the per-row check
+        return pc.cast(pc.if_else(missing, pa.scalar(None, pa.string()), trimmed), target), missing, pc.and_(missing, False)
+    except pa.ArrowInvalid:
+        pass
+    valid = pc.match_substring_regex(trimmed, pattern)
+    invalid = pc.and_(pc.invert(missing), pc.invert(valid))
+    if kind == "integer":
+        trimmed = pc.replace_substring_regex(trimmed, r"\.0*$", "")
+    parsed = pc.cast(pc.if_else(valid, trimmed, pa.scalar(None, pa.string())), target)
+    return parsed, missing, invalid
+
+
+def type_batch(batch):
+    # Types one block of text columns; returns the good rows and the quarantined ones
+    columns = {name: batch.column(name) for name in batch.schema.names}
+    error = pa.nulls(batch.num_rows, pa.string())
+    for name, kind in SOURCE_SCHEMA.items():
+        if name not in columns:
+            continue
+        columns[name], missing, invalid = parse_column(batch.column(name), kind)
+        failures = [(invalid, f"invalid {name}")]
+        if kind == "timestamp":
+            # A row without a time cannot be placed in any period either
+            failures.append((missing, f"missing {name}"))
+        for mask, label in failures:
+            error = pc.if_else(pc.and_(pc.is_null(error), mask), label, error)
+
+    good = pc.is_null(error)
+    quarantine = batch.filter(pc.invert(good)).to_pandas()
+    quarantine.insert(0, "error", error.filter(pc.invert(good)).to_pandas())
+    return pa.RecordBatch.from_pydict(columns).filter(good), quarantine
+
+
+def read_transactions_arrow(source):
+    names = csv_header(source)
+    if "CATEGORY_ID" not in names:
+        raise ValueError("'CATEGORY_ID' column not found in transactions file.")
+
+    # Rows with the wrong number of fields never reach a block; the handler runs on the reading thread
+    malformed = []
+
+    def quarantine_row(row):
+        malformed.append({"error": FIELD_COUNT_ERROR, "raw": row.text})
+        return "skip"
+
+    # The streaming reader splits the text into blocks on one thread; the blocks are typed in
+    # vectorized passes on PARSE_WORKERS threads, so one bad field quarantines its row and only
+    # a couple of text blocks per thread are held in memory
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(
+            column_names=names, skip_rows=1, block_size=ARROW_BLOCK_SIZE, encoding="utf-8"
+        ),
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=quarantine_row),
+        convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in names}),
+    )
+    batches, rejected = [], []
+
+    def collect(future):
+        good, quarantine = future.result()
+        batches.append(good)
+        rejected.append(quarantine)
+
+    # A bounded window of blocks in flight keeps memory flat; taking them in submission order keeps row order
+    with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as executor:
+        pending = deque()
+        for batch in reader:
+            pending.append(executor.submit(type_batch, batch))
+            if len(pending) >= 2 * PARSE_WORKERS:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    if not batches:
+        batches.append(type_batch(pa.RecordBatch.from_pylist([], schema=reader.schema))[0])
+    quarantine = pd.concat([pd.DataFrame(malformed, columns=["error", "raw"])] + rejected, ignore_index=True)
+
+    final_data = pa.Table.from_batches(batches).to_pandas()
+    total = len(final_data) + len(quarantine)
+    if total and len(quarantine) > MAX_BAD_FRACTION * total:
+        error, count = Counter(quarantine["error"]).most_common(1)[0]
+        raise ValueError(
+            f"{len(quarantine):,} of {total:,} transaction rows could not be read ({count:,} with {error}); "
+            "the export format probably changed. Check SEASONALITY_TIMESTAMP_FORMAT and the columns."
+        )
+    return final_data.rename(columns={"CATEGORY_ID": "CAT_ID"}), quarantine
+
+
+def read_transactions_pandas(source, chunksize=CHUNKSIZE):
+    chunks = []
+    for chunk in pd.read_csv(source, encoding='utf-8', chunksize=chunksize, header=0, on_bad_lines='skip', delimiter=',', quotechar='"'):
+        chunk.columns = chunk.columns.str.strip()
+        if "CATEGORY_ID" not in chunk.columns:
+            raise ValueError("'CATEGORY_ID' column not found in transactions file.")
+        chunks.append(chunk.rename(columns={"CATEGORY_ID": "CAT_ID"}))
+
+    # A single concat at the end keeps ingest linear in the number of rows
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+def write_quarantine(quarantine, path):
+    # Appended, so the rows of every incremental ingest end up in one file
+    header = not os.path.exists(path)
+    quarantine.to_csv(path, mode="a", header=header, index=False)
+
+
+def ingest_transactions(transactions_path, listings_path, chunksize=CHUNKSIZE, quarantine_path=None):
+    start = time.perf_counter()
+    with stage("ingest: listings and Level-1 cleanup"):
+        lookup, levels = build_level1_lookup(load_listings(listings_path))
+
+    if CSV_READER == "arrow":
+        with stage("ingest: parse transactions CSV (arrow)"):
+            final_data, quarantine = read_transactions_arrow(transactions_path)
+    else:
+        with stage("ingest: read transactions CSV"):
+            final_data = read_transactions_pandas(transactions_path, chunksize)
+        quarantine = pd.DataFrame(columns=["error"])
+    if not len(final_data) and not len(quarantine):
+        raise ValueError("No rows found in transactions file.")
+
+    final_data["Level-1"] = map_level1(final_data["CAT_ID"], lookup, levels)
+    bytes_before = frame_memory(final_data)
+    # Level-1 categories come from the listings table, so separately ingested batches line up
+    with stage("ingest: schema and pd.to_datetime"):
+        final_data = apply_schema(final_data, {"Level-1": sorted(levels)})
+
+    # Every page ignores rows without a valid timestamp, so drop them once here; the arrow
+    # reader has already quarantined them
+    invalid = final_data["TIMESTAMP"].isna()
+    if invalid.any():
+        quarantine = pd.concat([quarantine, pd.DataFrame({"error": ["invalid TIMESTAMP"] * int(invalid.sum())})])
+        final_data = final_data[~invalid].reset_index(drop=True)
+    bad_rows = dict(Counter(quarantine["error"]))
+    invalid_timestamps = sum(count for error, count in bad_rows.items() if error.endswith(" TIMESTAMP"))
+    if quarantine_path is not None and CSV_READER == "arrow" and len(quarantine):
+        write_quarantine(quarantine, quarantine_path)
+    with stage("ingest: calendar keys"):
+        final_data = add_calendar_keys(final_data)
+    with stage("ingest: partition sort"):
+        final_data = sort_partitions(final_data)
+    bytes_after = frame_memory(final_data)
+    logger.info(memory_report(bytes_before, bytes_after, MEMORY_BASELINES[CSV_READER]))
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "rows": len(final_data),
+        "seconds": elapsed,
+        "rows_per_second": len(final_data) / elapsed if elapsed > 0 else float("inf"),
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "memory_baseline": MEMORY_BASELINES[CSV_READER],
+        "invalid_timestamps": invalid_timestamps,
+        "bad_rows": bad_rows,
+    }
+    return final_data, stats
+
+
+def narrow_integer(series):
+    present = series.dropna()
+    downcast = "unsigned" if len(present) and present.min() >= 0 else "integer"
+    narrowed = pd.to_numeric(present, downcast=downcast)
+    if len(present) == len(series):
+        return narrowed
+    if narrowed.dtype.kind not in "iu":
+        return series
+    # A missing id would force float64; the nullable type of the same width (UInt16, Int32, ...) keeps it narrow
+    return series.astype(f"{'U' if narrowed.dtype.kind == 'u' else ''}Int{narrowed.dtype.itemsize * 8}")
+
+
+def narrow_price(series):
+    narrowed = series.astype(np.float32)
+    error = (narrowed.astype(np.float64) - series).abs().max()
+    return narrowed if pd.isna(error) or error <= PRICE_TOLERANCE else series
+
+
+def apply_schema(final_data, categories=None):
+    categories = categories or {}
+    final_data["TIMESTAMP"] = pd.to_datetime(final_data["TIMESTAMP"], errors="coerce")
+    for column in CATEGORY_COLUMNS:
+        final_data[column] = final_data[column].astype(pd.CategoricalDtype(categories.get(column)))
+    for column in INTEGER_COLUMNS:
+        final_data[column] = narrow_integer(pd.to_numeric(final_data[column], errors="coerce"))
+    final_data[PRICE_COLUMN] = narrow_price(pd.to_numeric(final_data[PRICE_COLUMN], errors="coerce"))
+    return final_data
+
+
+def add_calendar_keys(final_data):
+    timestamp = final_data["TIMESTAMP"].dt
+    iso = timestamp.isocalendar()
+    keys = {
+        "year": timestamp.year,
+        "month": timestamp.month,
+        "iso_year": iso.year,
+        "week": iso.week,
+        "day": timestamp.day,
+        "week_of_month": timestamp.day // 7 + 1,
+        "weekday": timestamp.weekday,
+        "hour": timestamp.hour,
+    }
+    for column in CALENDAR_COLUMNS:
+        final_data[column] = narrow_integer(keys[column].astype(np.int64))
+    return final_data
+
+
+def append_rows(final_data, new_rows):
+    frames = [final_data, new_rows]
+    for column in CATEGORY_COLUMNS:
+        categories = final_data[column].cat.categories.union(new_rows[column].cat.categories)
+        frames = [
+            frame if frame[column].cat.categories.equals(categories)
+            else frame.assign(**{column: frame[column].cat.set_categories(categories)})
+            for frame in frames
+        ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def frame_memory(final_data):
+    return int(final_data.memory_usage(deep=True).sum())
+
+
+def memory_report(bytes_before, bytes_after, baseline):
+    ratio = bytes_before / bytes_after if bytes_after else float("inf")
+    return (
+        f"final_data memory: {bytes_before / 2**20:,.1f} MB {baseline} -> "
+        f"{bytes_after / 2**20:,.1f} MB with the declared schema ({ratio:.1f}x smaller)"
+    )
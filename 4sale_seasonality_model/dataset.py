@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+from batch import PRECOMPUTED_DIR_ENV, load_precomputed, manifest_version
+from cache import source_key
+from data_processing import load_listings
+from shared import SHARED, open_published, publish
+from sources import LISTINGS_FILE, TRANSACTIONS_FILE, iter_sources
+from warehouse import open_dataset
+
+# How long a process trusts its downloaded copy before checking the source again
+SOURCE_TTL = int(os.environ.get("SEASONALITY_SOURCE_TTL", "3600"))
+
+# With copy-on-write, a view can never write through to the frame it came from
+pd.set_option("mode.copy_on_write", True)
+
+
+_fetch_lock = threading.Lock()
+_fetched = {}
+
+
+def _fetched_sources(progress=None):
+    # Not a cache_resource: the progress callback draws on the calling session's page,
+    # and Streamlit would replay those elements on every cache hit
+    with _fetch_lock:
+        if not _fetched or time.monotonic() - _fetched["at"] > SOURCE_TTL:
+            paths = {}
+            for name, path in iter_sources(progress):
+                paths[name] = path
+                if name == LISTINGS_FILE and TRANSACTIONS_FILE not in paths:
+                    # Parsed while the transactions download; a rebuild reuses the parsed frame
+                    load_listings(path)
+            _fetched["paths"] = paths[TRANSACTIONS_FILE], paths[LISTINGS_FILE]
+            _fetched["at"] = time.monotonic()
+        return _fetched["paths"]
+
+
+# One entry per server process, shared by every session. The key is the
+# content hash of the sources, so the dataset is only rebuilt when they change.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _shared_dataset(key, _transactions_path, _listings_path):
+    if not SHARED:
+        return open_dataset(_transactions_path, _listings_path)
+    # Another process already published these sources: map its file and serve right away
+    dataset = open_published(key)
+    if dataset is not None:
+        return dataset
+    built = open_dataset(_transactions_path, _listings_path)
+    publish(built, key)
+    # Serve from the mapping too, so the private copy is freed once this returns
+    dataset = open_published(key)
+    return built if dataset is None else dict(dataset, stats=built["stats"])
+
+
+def get_dataset(progress=None):
+    transactions_path, listings_path = _fetched_sources(progress)
+    key = source_key(transactions_path, listings_path)
+    return _shared_dataset(key, transactions_path, listings_path)
+
+
+def precomputed_dir():
+    return os.environ.get(PRECOMPUTED_DIR_ENV)
+
+
+# Keyed by the manifest's mtime, so a new batch run is picked up on the next rerun
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _shared_precomputed(directory, version):
+    return load_precomputed(directory)
+
+
+def get_precomputed(directory):
+    return _shared_precomputed(directory, manifest_version(directory))
+
+
+def session_view(final_data):
+    # Read-only to the page: any write lands on a private copy, never the shared frame
+    return final_data.copy(deep=False)
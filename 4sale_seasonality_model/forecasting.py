@@ -0,0 +1,224 @@
+import multiprocessing
+import os
+import threading
+import warnings
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.arima.model import ARIMA
+
+from kernel import category_column
+from model_cache import model_key, read_model, read_params, write_model, write_params
+from seasonality import additive_decomposition
+
+ARIMA_ORDER = (1, 1, 1)
+FORECAST_STEPS = 5
+
+# Weeks per seasonal cycle; the decomposition needs two full cycles
+WEEK_PERIOD = 52
+
+# Granularity the continuous weekly series is cached and stored under, apart from the
+# week-of-year buckets of "weekly"
+WEEKLY_SERIES = "weekly_series"
+
+# Number of processes used to fit one ARIMA per category; 1 fits in-process
+ARIMA_WORKERS = int(os.environ.get("SEASONALITY_ARIMA_WORKERS", os.cpu_count() or 1))
+
+# How a refit uses the parameters last fitted for the same category and granularity:
+# "warm" starts the optimizer from them, "filter" keeps them and only runs the Kalman
+# filter over the series, with no optimizer at all, "full" ignores them. A failed warm
+# start always falls back to a full fit.
+ARIMA_REFIT = os.environ.get("SEASONALITY_ARIMA_REFIT", "warm")
+REFIT_MODES = ["warm", "filter", "full"]
+if ARIMA_REFIT not in REFIT_MODES:
+    raise ValueError(f"SEASONALITY_ARIMA_REFIT must be one of {', '.join(REFIT_MODES)}, got {ARIMA_REFIT!r}.")
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def warm_fit(model, start_params, refit=ARIMA_REFIT):
+    # None sends the caller back to a full fit
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            if refit == "filter":
+                # The stored parameters as they are: one filter pass for the fitted values and forecast
+                model_fit = model.filter(start_params)
+                return model_fit if np.isfinite(model_fit.llf) else None
+            model_fit = model.fit(start_params=start_params)
+        except Exception:
+            # Whatever goes wrong from stored parameters (a shape mismatch, a numerical error), a full fit follows
+            return None
+    return model_fit if model_fit.mle_retvals.get("converged", True) else None
+
+
+def fit_arima(values, steps=FORECAST_STEPS, start_params=None):
+    model = ARIMA(values, order=ARIMA_ORDER)
+    model_fit, start = None, "full"
+    if start_params is not None and ARIMA_REFIT != "full" and len(start_params) == len(model.param_names):
+        model_fit = warm_fit(model, start_params)
+        start = ARIMA_REFIT if model_fit is not None else "fallback"
+    if model_fit is None:
+        model_fit = model.fit()
+    return {
+        "fittedvalues": np.asarray(model_fit.fittedvalues, dtype=np.float64),
+        "forecast": np.asarray(model_fit.forecast(steps=steps), dtype=np.float64),
+        "summary": str(model_fit.summary()),
+        "params": np.asarray(model_fit.params, dtype=np.float64),
+        "start": start,
+    }
+
+
+def _fit_or_error(values, start_params=None, steps=FORECAST_STEPS):
+    try:
+        return fit_arima(values, steps, start_params), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    # Sessions and batch threads share one pool, so only one of them may create it
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # Spawned workers stay alive between reruns, so the statsmodels import is paid once
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(broken):
+    global _pool, _pool_workers
+    with _pool_lock:
+        # Another session may already have replaced it
+        if _pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _pool, _pool_workers = None, None
+
+
+def map_fits(fit, series, workers=None, starts=None):
+    workers = ARIMA_WORKERS if workers is None else workers
+    starts = [None] * len(series) if starts is None else starts
+    if workers <= 1 or len(series) <= 1:
+        return [fit(values, start) for values, start in zip(series, starts)]
+    # map keeps submission order, so results line up with the input categories
+    pool = _get_pool(workers)
+    try:
+        return list(pool.map(fit, series, starts))
+    except BrokenProcessPool:
+        # A worker died (out of memory, a crash inside statsmodels): retry once on a fresh pool
+        _discard_pool(pool)
+        return list(_get_pool(workers).map(fit, series, starts))
+
+
+def cached_fits(series, granularity, workers=None, names=None):
+    keys = [model_key(values, ARIMA_ORDER, granularity, FORECAST_STEPS, ARIMA_REFIT) for values in series]
+    outcomes = [(read_model(key), None) for key in keys]
+    misses = [i for i, (fit, _) in enumerate(outcomes) if fit is None]
+
+    # Only series without a cached result reach statsmodels; named ones start from
+    # the parameters their category was last fitted with
+    stored = read_params(granularity, ARIMA_ORDER) if names is not None and misses else {}
+    starts = [stored.get(names[i]) if names is not None else None for i in misses]
+    starts_used = Counter()
+    for i, (fit, error) in zip(misses, map_fits(_fit_or_error, [series[i] for i in misses], workers, starts)):
+        if error is None:
+            write_model(keys[i], fit)
+            starts_used[fit["start"]] += 1
+        outcomes[i] = (fit, error)
+
+    if names is not None and misses:
+        params = {names[i]: fit["params"] for i, (fit, error) in enumerate(outcomes) if error is None and "params" in fit}
+        write_params(granularity, ARIMA_ORDER, params)
+
+    report = {"hits": len(series) - len(misses), "misses": len(misses), "starts": dict(starts_used)}
+    return outcomes, report
+
+
+def cached_fit(values, granularity, name=None):
+    names = None if name is None else [name]
+    [(fit, error)], report = cached_fits([np.asarray(values, dtype=np.float64)], granularity, workers=1, names=names)
+    if error is not None:
+        raise RuntimeError(error)
+    return fit, report
+
+
+def revenue_index(values, fittedvalues):
+    forecast = fittedvalues.copy()
+    forecast[0] = values[0]
+    forecast_mean = forecast.mean()
+    if forecast_mean > 1e-6:  # Prevent division by zero
+        return forecast / forecast_mean
+    return np.ones(len(values))
+
+
+def arima_revenue_index(data, granularity, workers=None):
+    column = category_column(data)
+    categories = data[column]
+    levels = categories.unique()
+    masks = [(categories == level).to_numpy() for level in levels]
+    series = [data["revenue"].fillna(0).to_numpy(dtype=np.float64)[mask] for mask in masks]
+    outcomes, report = cached_fits(series, granularity, workers, [(column, level) for level in levels])
+
+    index = np.ones(len(data))
+    report["failures"] = {}
+    report["forecasts"] = {}
+    for level, mask, values, (fit, error) in zip(levels, masks, series, outcomes):
+        if error is None:
+            index[mask] = revenue_index(values, fit["fittedvalues"])
+            report["forecasts"][level] = fit["forecast"]
+        else:
+            report["failures"][level] = error  # Fallback: revenue_index stays 1
+    return pd.Series(index, index=data.index), report
+
+
+def forecast_weeks(index):
+    return pd.DatetimeIndex(
+        [index[-1] + pd.Timedelta(weeks=step) for step in range(1, FORECAST_STEPS + 1)] if len(index) else [],
+        name=index.name,
+    )
+
+
+def weekly_models(series, workers=None):
+    # Every category of the wide weekly frame in one job: a single numpy pass for the
+    # decomposition, and the ARIMA fits through the shared pool and model cache
+    values = series.to_numpy(dtype=np.float64).T
+    components = None
+    if len(series) >= 2 * WEEK_PERIOD:
+        parts = additive_decomposition(values, WEEK_PERIOD)
+        components = {
+            name: pd.DataFrame(part.T, index=series.index, columns=series.columns)
+            for name, part in zip(("trend", "seasonal", "resid"), parts)
+        }
+
+    names = [(series.columns.name, level) for level in series.columns]
+    outcomes, report = cached_fits(list(values), WEEKLY_SERIES, workers, names)
+    forecasts = pd.DataFrame(index=forecast_weeks(series.index), columns=series.columns, dtype=np.float64)
+    report["failures"] = {}
+    report["forecasts"] = {}
+    report["summaries"] = {}
+    for level, (fit, error) in zip(series.columns, outcomes):
+        if error is None:
+            forecasts[level] = fit["forecast"]
+            report["forecasts"][level] = fit["forecast"]
+            report["summaries"][level] = fit["summary"]
+        else:
+            report["failures"][level] = error
+    return components, forecasts.dropna(axis=1, how="all"), report
+
+
+def describe_cache(report):
+    text = f"ARIMA model cache: {report['hits']} hits, {report['misses']} misses"
+    starts = report.get("starts", {})
+    refits = sum(count for start, count in starts.items() if start != "full")
+    if refits:
+        text += (f" ({starts.get('warm', 0)} warm-started, {starts.get('filter', 0)} filtered with stored parameters,"
+                 f" {starts.get('fallback', 0)} fell back to a full fit)")
+    return text
@@ -1,56 +1,25 @@
-import pandas as pd
 import streamlit as st
-import seaborn as sns
-import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
-
-def run(final_data, selected_level_1):
+import charts
+from kernel import category_column, granularity_table
+from index_engine import engine_selector, seasonality_index
+from periods import show_year_over_year
+from profiling import stage
+from seasonality import index_growth
+
+def run(aggregates, category, period=None):
     st.header("Hourly Seasonality Analysis")
+    engine = engine_selector()
+    if period is not None:
+        st.caption("Hour of day totals are kept per calendar month, so the date range covers the whole months it touches.")
 
-    final_data = st.session_state.final_data 
-    final_data["TIMESTAMP"] = pd.to_datetime(final_data["TIMESTAMP"])
-    final_data["hour"] = final_data["TIMESTAMP"].dt.hour
-    final_data["Level-1"] = final_data['Level-1'].str.replace('--_--', '').str.strip()
-    final_data = final_data[final_data['TRANSACTION_TYPE'] == 'Listing']
-
-    if selected_level_1 != "All":
-        final_data = final_data[final_data["Level-1"] == selected_level_1]
-
-
-    hourly_data = final_data.groupby(["Level-1", "hour"]).agg(
-        revenue=("PRICE", "sum"),
-        listings=("TRANSCATION_ID", "count")
-    ).reset_index()
-
-    hourly_data["revenue_index"] = 0
+    with stage("hourly: aggregate"):
+        hourly_data = granularity_table(aggregates, "hour", category, period=period)
 
-
-    for level in hourly_data["Level-1"].unique():
-        series = hourly_data[hourly_data["Level-1"] == level]["revenue"].fillna(0)
-
-        try:
-            model = ARIMA(series, order=(1, 1, 1))
-            model_fit = model.fit()
-            forecast = model_fit.fittedvalues
-            forecast.iloc[0] = series.iloc[0]
-            forecast_mean = forecast.mean()
-            if forecast_mean > 1e-6:  # Prevent division by zero
-                hourly_data.loc[
-                    hourly_data["Level-1"] == level, "revenue_index"
-                ] = forecast / forecast_mean
-            else:
-                hourly_data.loc[
-                    hourly_data["Level-1"] == level, "revenue_index"
-                ] = 1
-
-        except Exception as e:
-            st.warning(f"ARIMA failed for Level-1: {level} due to {e}")
-            hourly_data.loc[
-                hourly_data["Level-1"] == level, "revenue_index"
-            ] = 1  # Fallback: Set revenue_index to 1
+    with stage("hourly: seasonality index"):
+        hourly_data["revenue_index"] = seasonality_index(hourly_data, "hour", "hourly", engine)
 
     # Calculate growth percentage
-    hourly_data["growth%"] = hourly_data["revenue_index"].apply(lambda x: round((x - 1) * 100, 2))
+    hourly_data["growth%"] = index_growth(hourly_data["revenue_index"])
 
 
     def colorize(val):
@@ -58,26 +27,23 @@ def run(final_data, selected_level_1):
         return f'background-color: {color}; color: white'
 
 
-    styled_df = hourly_data.style.applymap(colorize, subset=["growth%"])
-    st.write("Processed Hourly Seasonality Data:")
-    st.dataframe(styled_df)
+    with stage("hourly: style table"):
+        styled_df = hourly_data.style.applymap(colorize, subset=["growth%"])
+        st.write("Processed Hourly Seasonality Data:")
+        st.dataframe(styled_df)
+
+    with stage("hourly: heatmap"):
+        column = category_column(hourly_data)
+        heatmap_data = hourly_data.pivot(index=column, columns="hour", values="revenue_index")
+        heatmap_data = heatmap_data.fillna(0).astype(float)
 
-    heatmap_data = hourly_data.pivot(index="Level-1", columns="hour", values="revenue_index")
-    heatmap_data = heatmap_data.fillna(0).astype(float)
+        # Plot heatmap
+        charts.heatmap(heatmap_data, title=f"Hourly Seasonality by {column}", cbar_label="Seasonality Index")
 
-    # Plot heatmap
-    plt.figure(figsize=(12, 6))
-    sns.heatmap(heatmap_data, annot=True, fmt=".2f", cmap="coolwarm", cbar_kws={'label': 'Seasonality Index'})
-    plt.title("Hourly Seasonality by Level-1")
-    st.pyplot(plt)
+    with stage("hourly: bar chart"):
+        hourly_bar = hourly_data.groupby('hour')['revenue'].sum()
 
-    hourly_bar = hourly_data.groupby('hour')['revenue'].sum()
+        # Plot a bar chart
+        charts.bar_chart(hourly_bar, 'Revenue by monthly', 'hour', 'Total Revenue')
 
-    # Plot a bar chart
-    plt.figure(figsize=(10, 6))
-    hourly_bar.plot(kind='bar', color='skyblue')
-    plt.title('Revenue by monthly')
-    plt.xlabel('hour')
-    plt.ylabel('Total Revenue')
-    plt.xticks(rotation=45)
-    st.pyplot(plt)
+    show_year_over_year(aggregates, "hour", category, period)
@@ -0,0 +1,140 @@
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from batch import ARTIFACTS
+from forecasting import WEEK_PERIOD, WEEKLY_SERIES, arima_revenue_index, describe_cache, forecast_weeks
+from kernel import category_column
+from model_cache import series_digest
+from seasonality import FAST_METHODS, fast_revenue_index
+
+ENGINES = ["ARIMA", "Fast"]
+
+# Batch tables served in place of live ARIMA fits, keyed by granularity
+_precomputed = {}
+
+# Batch forecasts and decompositions served on the weekly pages, keyed by artifact name
+_artifacts = {}
+
+PRECOMPUTED_CAPTION = "ARIMA forecasts served from the precomputed batch results"
+
+
+def use_precomputed(dataset):
+    _precomputed.update(dataset["tables"])
+    _artifacts.update({name: dataset[name] for name in ARTIFACTS})
+    _artifacts["failures"] = dataset["failures"]
+
+
+def stored_weekly_models(series, category, period):
+    # The batch decomposed and fitted the Level-1 weekly series over the whole history only
+    forecasts, components = _artifacts.get("forecasts"), _artifacts.get("weekly_components")
+    if forecasts is None or components is None or category["depth"] != 1 or period is not None:
+        return None
+    forecasts = forecasts[forecasts["granularity"] == WEEKLY_SERIES].astype({"Level-1": str})
+    failures = _artifacts["failures"].get(WEEKLY_SERIES, {})
+    levels = series.columns.astype(str)
+    if set(forecasts["Level-1"]) | set(failures) != set(levels):
+        return None
+
+    parts = None
+    if len(components):
+        components = components.astype({"Level-1": str}).assign(week_start=lambda frame: pd.to_datetime(frame["week_start"]))
+        parts = {
+            name: components.pivot(index="week_start", columns="Level-1", values=name).reindex(columns=levels)
+            for name in ("trend", "seasonal", "resid")
+        }
+        if not parts["trend"].index.equals(pd.DatetimeIndex(series.index)):
+            return None
+        for part in parts.values():
+            part.index, part.columns = series.index, series.columns
+    elif len(series) >= 2 * WEEK_PERIOD:
+        return None
+
+    fitted = forecasts.pivot(index="step", columns="Level-1", values="forecast")
+    keep = levels.isin(fitted.columns)
+    table = pd.DataFrame(
+        fitted.reindex(columns=levels[keep]).to_numpy(), index=forecast_weeks(series.index), columns=series.columns[keep]
+    )
+    return parts, table, {"failures": failures, "summaries": {}}
+
+
+def stored_week_of_month_forecast(values, category, month):
+    # Picks down to one Level-1 were fitted by the batch; the input digest catches a narrower period
+    forecasts = _artifacts.get("weekly_month_forecasts")
+    path = category["path"]
+    if forecasts is None or len(path) > 1:
+        return None
+    level = path[0] if path else "All"
+    rows = forecasts[
+        (forecasts["Level-1"].astype(str) == str(level))
+        & (forecasts["month"].astype(str) == str(month))
+        & (forecasts["input"] == series_digest(values))
+    ]
+    return rows.sort_values("step")["forecast"].to_numpy() if len(rows) else None
+
+
+def engine_selector():
+    engine = st.sidebar.selectbox("Seasonality engine", options=ENGINES, key="seasonality_engine")
+    method = st.sidebar.selectbox("Fast index method", options=list(FAST_METHODS), key="fast_index_method")
+    compare = st.sidebar.checkbox("Compare ARIMA and fast index", key="compare_engines")
+    return {"engine": engine, "method": method, "compare": compare}
+
+
+def precomputed_index(data, key, granularity):
+    stored = _precomputed.get(granularity)
+    # The batch fits one series per Level-1; deeper breakdowns are fitted live
+    if stored is None or category_column(data) != "Level-1":
+        return None
+    merged = data[["Level-1", key, "revenue"]].astype({"Level-1": str}).merge(
+        stored[["Level-1", key, "revenue", "arima_index"]].astype({"Level-1": str}),
+        how="left", on=["Level-1", key], suffixes=("", "_stored"),
+    )
+    # Any bucket the batch did not see, or a different total such as a narrower date range, means it is stale
+    if merged["arima_index"].isna().any() or not np.allclose(merged["revenue"], merged["revenue_stored"]):
+        return None
+    return pd.Series(merged["arima_index"].to_numpy(), index=data.index)
+
+
+def _arima_index(data, key, granularity):
+    stored = precomputed_index(data, key, granularity)
+    if stored is not None:
+        st.caption("ARIMA index served from the precomputed batch results")
+        return stored
+
+    revenue_index, arima_report = arima_revenue_index(data, granularity)
+    for level, error in arima_report["failures"].items():
+        st.warning(f"ARIMA failed for {category_column(data)}: {level} due to {error}")
+    st.caption(describe_cache(arima_report))
+    return revenue_index
+
+
+def seasonality_index(data, key, granularity, settings):
+    if not settings["compare"]:
+        if settings["engine"] == "Fast":
+            return fast_revenue_index(data, key, settings["method"])
+        return _arima_index(data, key, granularity)
+
+    start = time.perf_counter()
+    arima_index = _arima_index(data, key, granularity)
+    arima_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast_index = fast_revenue_index(data, key, settings["method"])
+    fast_seconds = time.perf_counter() - start
+
+    difference = (arima_index - fast_index).abs()
+    st.write("ARIMA vs fast seasonality index")
+    st.caption(
+        f"ARIMA: {arima_seconds:.3f}s, fast ({settings['method'].lower()}): {fast_seconds:.4f}s. "
+        f"Mean |difference| {difference.mean():.3f}, max {difference.max():.3f}."
+    )
+    st.dataframe(pd.DataFrame({
+        category_column(data): data[category_column(data)],
+        key: data[key],
+        "arima_index": arima_index,
+        "fast_index": fast_index,
+        "difference": arima_index - fast_index,
+    }))
+    return arima_index if settings["engine"] == "ARIMA" else fast_index
@@ -1,33 +1,64 @@
-import pandas as pd
 import streamlit as st
+from partitions import month_bounds, select_rows
+from sketches import USER_COUNTS, approximate_users, range_users, standard_error
 
-def run(final_data):
+def run(final_data_summary, sketches=None, selected_level_1="All", final_data=None, partitions=None):
     st.header("Data Summary information ")
     st.subheader("Aggregation (Yearly and Monthly)")
-    final_data_summary = calculate_summary(final_data, 'TIMESTAMP')
     final_data_summary['year'] = final_data_summary['year'].astype(str) 
     st.dataframe(final_data_summary)
+    if sketches is not None and len(sketches["keys"]):
+        show_range_users(sketches, selected_level_1, final_data, partitions)
 
 
-def calculate_summary(df, date_col):
-    df[date_col] = pd.to_datetime(df[date_col])
-    df['year'] = df[date_col].dt.year
-    df['month'] = df[date_col].dt.month
+def show_range_users(sketches, selected_level_1, final_data=None, partitions=None):
+    st.subheader("Distinct users over a range of months")
+    periods = sketches["keys"][["year", "month"]].drop_duplicates().sort_values(["year", "month"])
+    months = [(int(year), int(month)) for year, month in periods.itertuples(index=False)]
+    start, end = st.select_slider(
+        "Months", options=months, value=(months[0], months[-1]), format_func=lambda period: f"{period[0]}-{period[1]:02d}"
+    )
+
+    # Merged from the monthly sketches: no pass over the rows whatever the range
+    users = range_users(sketches, start, end, selected_level_1)
+    columns = st.columns(2)
+    columns[0].metric(
+        f"Approximate distinct users ({selected_level_1})", f"{users:,}",
+        help=f"HyperLogLog estimate, about ±{standard_error(sketches['precision']):.1%} standard error",
+    )
+    if final_data is not None and USER_COUNTS == "both":
+        # Only the rows of the picked category and months are read, as slices of the partitioned frame
+        rows = select_rows(final_data, partitions, None, selected_level_1, *month_bounds(start, end))
+        exact = rows["USER_ID"].nunique()
+        columns[1].metric("Exact distinct users", f"{exact:,}", delta=f"{(users / exact - 1) * 100 if exact else 0:+.2f}% error",
+                          delta_color="off")
 
-    summary = df.groupby(['year', 'month']).agg(
-        total_transactions=('TRANSCATION_ID', 'count'),
-        total_revenue=('PRICE', 'sum'),
-        total_users=('USER_ID', 'nunique')
-    ).reset_index()
-    return summary
 
-def calculate_yearly_totals(df, date_col):
-    df[date_col] = pd.to_datetime(df[date_col])
-    df['year'] = df[date_col].dt.year
+def calculate_summary(df, exact_users=True):
+    summary = df.groupby(['year', 'month']).agg(**total_columns(exact_users)).reset_index()
+    return summary
 
-    yearly_totals = df.groupby('year').agg(
-        total_transactions=('TRANSCATION_ID', 'count'),
-        total_revenue=('PRICE', 'sum'),
-        total_users=('USER_ID', 'nunique')
-    ).reset_index()
+def calculate_yearly_totals(df, exact_users=True):
+    yearly_totals = df.groupby('year').agg(**total_columns(exact_users)).reset_index()
     return yearly_totals
+
+
+def total_columns(exact_users=True):
+    columns = {
+        "total_transactions": ('TRANSCATION_ID', 'count'),
+        "total_revenue": ('PRICE', 'sum'),
+    }
+    # The per-group nunique is the most memory-hungry aggregation; the sketches replace it
+    if exact_users:
+        columns["total_users"] = ('USER_ID', 'nunique')
+    return columns
+
+
+def add_user_estimates(totals, sketches, keys):
+    if sketches is None or USER_COUNTS == "exact":
+        return totals
+    totals = totals.merge(approximate_users(sketches, keys).astype({key: totals[key].dtype for key in keys}), on=keys, how="left")
+    totals["approx_users"] = totals["approx_users"].fillna(0).astype("int64")
+    if "total_users" in totals.columns:
+        totals["approx_error%"] = (totals["approx_users"] / totals["total_users"] - 1) * 100
+    return totals
@@ -1,10 +1,14 @@
+import calendar
+
 import streamlit as st
 import pandas as pd
-from info import calculate_yearly_totals
-import matplotlib.pyplot as plt
-import seaborn as sns
+import charts
+from cube import rollup, select
+from kernel import granularity_table
+from periods import describe_period, show_year_over_year
+from profiling import stage
 
-def run(final_data):
+def run(yearly_totals, cube, aggregates, period=None):
     st.title("Business Insights & Recommendations")
    
     
@@ -17,86 +21,87 @@ def run(final_data):
     """)
 
     st.subheader("Challenges")
-    st.write("""
-    Based on the data below, the 2023 data is completely missing, and there is a clear decrease in transactions for 2022. 
-    Due to the absence of recent data and the noticeable decrease in past transactions, we cannot fully rely on the model's accuracy 
-    for future predictions. The missing data impacts the ability to make accurate forecasts and seasonality calculations.
+    missing, latest, previous, change = describe_years(yearly_totals)
+    if missing:
+        st.write(f"""
+    Based on the data below, the {", ".join(map(str, missing))} data is completely missing.
+    Due to the gaps in the data, we cannot fully rely on the model's accuracy for future predictions.
+    The missing data impacts the ability to make accurate forecasts and seasonality calculations.
+    """)
+    elif latest is not None:
+        st.write(f"""
+    Based on the data below, every year from {yearly_totals['year'].min()} to {latest} has transactions.
     """)
-    yearly_totals = calculate_yearly_totals(final_data, 'TIMESTAMP')
     yearly_totals['year'] = yearly_totals['year'].astype(str) 
     st.dataframe(yearly_totals)
 
-    st.write("""
-    From the above table, we can observe around a 90% increase in transactions in 2024 compared to 2022. 
-    While this growth is notable, we must acknowledge the missing data for 2023. 
-    Even though we see a significant increase, we cannot fully rely on this trend for future predictions 
-    due to the lack of 2023 data, which limits the model's accuracy and reliability.
+    if previous is not None:
+        direction = "increase" if change >= 0 else "decrease"
+        st.write(f"""
+    From the above table, we can observe around a {abs(change):.1f}% {direction} in transactions in {latest} compared to {previous}.
     """)
-    
-    st.write("""
-         The chart below shows that October and November exhibit the best performance, with the highest revenue.
+
+    with stage("insights: revenue by month"):
+        if period is None:
+            listings = select(cube)
+            month_bar = rollup(listings, ["month"])
+            month_bar = month_bar.groupby('month')['revenue'].sum()
+        else:
+            # A picked range is summed from the running totals instead of the whole-history cube
+            st.caption(f"Revenue by month from {describe_period(period)}")
+            month_bar = granularity_table(aggregates, "month", period=period).groupby("month")["revenue"].sum()
+
+        best = [calendar.month_name[int(month)] for month in month_bar.nlargest(2).index]
+        if best:
+            st.write(f"""
+         The chart below shows that {" and ".join(best)} exhibit the best performance, with the highest revenue.
                    """)
 
-    final_data["TIMESTAMP"] = pd.to_datetime(final_data["TIMESTAMP"])
-    final_data["month"] = final_data["TIMESTAMP"].dt.month
-    final_data["Level-1"] = final_data['Level-1'].str.replace('--_--', '').str.strip()
-    final_data = final_data[final_data['TRANSACTION_TYPE'] == 'Listing']
-    month_bar = final_data.groupby(["month"]).agg(
-        revenue=("PRICE", "sum"))
-    month_bar = month_bar.groupby('month')['revenue'].sum()
-
-    # Plot a bar chart
-    plt.figure(figsize=(10, 6))
-    month_bar.plot(kind='bar', color='skyblue')
-    plt.title('Revenue by monthly')
-    plt.xlabel('month')
-    plt.ylabel('Total Revenue')
-    plt.xticks(rotation=45)
-    st.pyplot(plt)
+        # Plot a bar chart
+        charts.bar_chart(month_bar, 'Revenue by monthly', 'month', 'Total Revenue')
+    show_year_over_year(aggregates, "month", None, period)
     
     st.subheader("Heatmap of Total Transactions (Year vs. Month)")
 
     st.write("""
          The chart below highlights significant missing data, which impacts the accuracy of any seasonality forecasting or pattern detection.
                    """)
-    plot_heatmap(final_data, 'TIMESTAMP')
-
-def plot_heatmap(df, date_col):
-    df[date_col] = pd.to_datetime(df[date_col])
-    df['year'] = df[date_col].dt.year
-    df['month'] = df[date_col].dt.month
-
-    heatmap_data = df.groupby(['year', 'month'])['TRANSCATION_ID'].count().unstack(fill_value=0)
+    with stage("insights: heatmaps"):
+        plot_heatmap(cube)
+
+def describe_years(yearly_totals):
+    # Years without transactions between the first and the last, and the latest year's change
+    totals = yearly_totals.set_index(yearly_totals["year"].astype(int))["total_transactions"]
+    observed = totals[totals > 0]
+    if not len(observed):
+        return [], None, None, 0.0
+    missing = [year for year in range(observed.index.min(), observed.index.max() + 1) if year not in observed.index]
+    if len(observed) < 2:
+        return missing, observed.index[-1], None, 0.0
+    return missing, observed.index[-1], observed.index[-2], (observed.iloc[-1] / observed.iloc[-2] - 1) * 100
+
+def plot_heatmap(cube):
+    heatmap_data = rollup(select(cube), ['year', 'month']).set_index(['year', 'month'])['listings'].unstack(fill_value=0)
     
-    plt.figure(figsize=(10, 6))
-    sns.heatmap(heatmap_data, annot=True, fmt="d", cmap="YlGnBu", cbar_kws={'label': 'Total Transactions'})
-    plt.xlabel("Month")
-    plt.ylabel("Year")
-    st.pyplot(plt)
-
+    charts.heatmap(heatmap_data, xlabel="Month", ylabel="Year", figsize=(10, 6), fmt="d", cmap="YlGnBu",
+                   cbar_label="Total Transactions")
 
-    levels = st.session_state.final_data 
-    levels["TIMESTAMP"] = pd.to_datetime(levels["TIMESTAMP"])
-    levels["month"] = levels["TIMESTAMP"].dt.month
-    levels["Level-1"] = levels['Level-1'].str.replace('--_--', '').str.strip()
 
     st.write("""
          The chart below highlights significant missing data on monthly level per category, which also impacts the accuracy of any seasonality forecasting or pattern detection.
                    """)
     
     st.subheader("Heatmap: Months vs. Level_1 Category (Total Transactions)")
+    levels = rollup(select(cube, transaction_type=None), ['month', 'Level-1'])
     if 'Level-1' in levels.columns:
-        plot_heatmap_level(levels, index='month', columns='Level-1', values='TRANSCATION_ID', aggfunc='count')
+        plot_heatmap_level(levels, index='month', columns='Level-1', values='listings', aggfunc='sum')
     else:
         st.warning("The 'level_1' column is not present in the dataset.")
 
 def plot_heatmap_level(df, index, columns, values, aggfunc='sum'):
-    pivot_table = pd.pivot_table(df, index=index, columns=columns, values=values, aggfunc=aggfunc)
-    plt.figure(figsize=(10, 6))
-    sns.heatmap(pivot_table, annot=True, fmt='.0f', cmap='YlGnBu', cbar=True)
-    plt.xlabel(columns.capitalize())
-    plt.ylabel(index.capitalize())
-    st.pyplot(plt)
+    pivot_table = pd.pivot_table(df, index=index, columns=columns, values=values, aggfunc=aggfunc, observed=True)
+    charts.heatmap(pivot_table, xlabel=columns.capitalize(), ylabel=index.capitalize(), figsize=(10, 6), fmt='.0f',
+                   cmap='YlGnBu')
 
 
 
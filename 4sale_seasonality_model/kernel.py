@@ -0,0 +1,346 @@
+import numpy as np
+import pandas as pd
+
+from partitions import select_rows
+
+# Bucket key -> number of integer codes it can take (codes are the raw key values)
+BUCKET_SIZES = {
+    "month": 13,
+    "week": 54,
+    "day": 32,
+    "week_of_month": 6,
+    "weekday": 7,
+    "hour": 24,
+}
+
+MONTHS = BUCKET_SIZES["month"]
+
+# Consecutive ISO weeks are numbered from the Monday before 1970-01-01, a Thursday
+EPOCH_WEEKDAY = 3
+
+# Category hierarchy carried by the aggregates; deeper FULL_PATH segments fold into Level-3
+LEVEL_COLUMNS = ["Level-1", "Level-2", "Level-3"]
+
+
+def category_column(data):
+    # Every table is grouped by exactly one level of the category tree
+    return next(column for column in LEVEL_COLUMNS if column in data.columns)
+
+
+def category_codes(cat_ids, tree, depth=len(LEVEL_COLUMNS)):
+    codes = tree["codes"][depth - 1]
+    cat_ids = pd.to_numeric(cat_ids, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    known = ~np.isnan(cat_ids) & (cat_ids >= 0) & (cat_ids < len(codes))
+    result = np.full(len(cat_ids), -1, dtype=np.int64)
+    result[known] = codes[cat_ids[known].astype(np.int64)]
+    return result
+
+
+def accumulate(level_codes, n_levels, bucket_codes, n_buckets, revenue, counts):
+    flat = level_codes * n_buckets + bucket_codes
+    size = n_levels * n_buckets
+    shape = (n_levels, n_buckets)
+    return {
+        "revenue": np.bincount(flat, weights=revenue, minlength=size).reshape(shape),
+        "listings": np.bincount(flat, weights=counts, minlength=size).astype(np.int64).reshape(shape),
+        "rows": np.bincount(flat, minlength=size).reshape(shape),
+    }
+
+
+def day_numbers(timestamps):
+    return timestamps.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def month_numbers(timestamps):
+    return timestamps.to_numpy().astype("datetime64[M]").astype(np.int64)
+
+
+def week_numbers(timestamps):
+    return (day_numbers(timestamps) + EPOCH_WEEKDAY) // 7
+
+
+def week_starts(numbers):
+    return pd.DatetimeIndex((np.asarray(numbers) * 7 - EPOCH_WEEKDAY).astype("datetime64[D]").astype("datetime64[ns]"))
+
+
+def accumulate_span(leaf_codes, n_leaves, positions, revenue, counts, buckets=None, n_buckets=1):
+    # One dense column per position from the first to the last, so gaps come out as zeros
+    first = int(positions.min()) if len(positions) else 0
+    n_positions = int(positions.max()) - first + 1 if len(positions) else 0
+    if buckets is None:
+        return accumulate(leaf_codes, n_leaves, positions - first, n_positions, revenue, counts), first
+    arrays = accumulate(leaf_codes, n_leaves, (positions - first) * n_buckets + buckets, n_positions * n_buckets, revenue, counts)
+    return {name: values.reshape(n_leaves, n_positions, n_buckets) for name, values in arrays.items()}, first
+
+
+def prefix_sums(arrays):
+    # A leading zero column makes the total over positions [a, b) one subtraction, values[:, b] - values[:, a]
+    return {
+        name: np.concatenate([np.zeros((values.shape[0], 1) + values.shape[2:], values.dtype), values.cumsum(axis=1)], axis=1)
+        for name, values in arrays.items()
+    }
+
+
+def prefix_steps(arrays):
+    return {name: np.diff(values, axis=1) for name, values in arrays.items()}
+
+
+def aggregate_listings(final_data, tree, partitions=None):
+    if partitions is None:
+        listings = final_data[final_data["TRANSACTION_TYPE"] == "Listing"]
+    else:
+        listings = select_rows(final_data, partitions, "Listing")
+
+    # Cells are kept per leaf category; Level-1 and Level-2 are integer rollups of them
+    leaf_codes = category_codes(listings["CAT_ID"], tree)
+    listings = listings[leaf_codes >= 0]
+    leaf_codes = leaf_codes[leaf_codes >= 0]
+    n_leaves = len(tree["labels"][-1])
+
+    # Decode the shared inputs once; every granularity reuses them
+    revenue = np.nan_to_num(listings["PRICE"].to_numpy(dtype=np.float64))
+    counts = listings["TRANSCATION_ID"].notna().to_numpy(dtype=np.float64)
+    month = listings["month"].to_numpy().astype(np.int64)
+
+    aggregates = {"tree": tree}
+    for key, n_buckets in BUCKET_SIZES.items():
+        bucket_codes = listings[key].to_numpy().astype(np.int64)
+        if key == "week_of_month":
+            # Keep month as a second axis so the weekly-in-month page can filter by it
+            arrays = accumulate(leaf_codes, n_leaves, month * n_buckets + bucket_codes, MONTHS * n_buckets, revenue, counts)
+            arrays = {name: values.reshape(n_leaves, MONTHS, n_buckets) for name, values in arrays.items()}
+        else:
+            arrays = accumulate(leaf_codes, n_leaves, bucket_codes, n_buckets, revenue, counts)
+        aggregates[key] = arrays
+
+    # Continuous (ISO year, week) series for the time series models, next to the week-of-year buckets
+    aggregates["weeks"], aggregates["first_week"] = accumulate_span(
+        leaf_codes, n_leaves, week_numbers(listings["TIMESTAMP"]), revenue, counts
+    )
+
+    # Running totals per day, and per calendar month and hour, for the date range and year-over-year views
+    days, aggregates["first_day"] = accumulate_span(leaf_codes, n_leaves, day_numbers(listings["TIMESTAMP"]), revenue, counts)
+    aggregates["days"] = prefix_sums(days)
+    month_hours, aggregates["first_month"] = accumulate_span(
+        leaf_codes, n_leaves, month_numbers(listings["TIMESTAMP"]), revenue, counts,
+        listings["hour"].to_numpy().astype(np.int64), BUCKET_SIZES["hour"],
+    )
+    aggregates["month_hours"] = prefix_sums(month_hours)
+    return aggregates
+
+
+def same_tree(tree, other):
+    return (
+        all(left.equals(right) for left, right in zip(tree["labels"], other["labels"]))
+        and np.array_equal(tree["codes"], other["codes"])
+    )
+
+
+def merge_aggregates(aggregates, delta):
+    if not same_tree(aggregates["tree"], delta["tree"]):
+        raise ValueError("Cannot merge aggregates built over different category trees.")
+    merged = {"tree": aggregates["tree"]}
+    for key in BUCKET_SIZES:
+        merged[key] = {name: values + delta[key][name] for name, values in aggregates[key].items()}
+    merged["weeks"], merged["first_week"] = merge_span(
+        aggregates["weeks"], aggregates["first_week"], delta["weeks"], delta["first_week"]
+    )
+    # Running totals are merged as per-position values, then summed up again
+    for key, first_key in (("days", "first_day"), ("month_hours", "first_month")):
+        steps, merged[first_key] = merge_span(
+            prefix_steps(aggregates[key]), aggregates[first_key], prefix_steps(delta[key]), delta[first_key]
+        )
+        merged[key] = prefix_sums(steps)
+    return merged
+
+
+def merge_span(arrays, first, delta, delta_first):
+    # Both sides are placed on the union of their position ranges before adding
+    spans = [
+        (start, start + parts["rows"].shape[1])
+        for parts, start in ((arrays, first), (delta, delta_first)) if parts["rows"].shape[1]
+    ]
+    if not spans:
+        return arrays, first
+    union_first = min(start for start, _ in spans)
+    n_positions = max(end for _, end in spans) - union_first
+    merged = {}
+    for name, values in arrays.items():
+        total = np.zeros((values.shape[0], n_positions) + values.shape[2:], dtype=values.dtype)
+        for parts, start in ((arrays, first), (delta, delta_first)):
+            part = parts[name]
+            offset = start - union_first
+            total[:, offset:offset + part.shape[1]] += part
+        merged[name] = total
+    return merged, union_first
+
+
+def node_starts(tree, depth):
+    # Leaves are sorted by path, so the leaves under any node form one contiguous run
+    return np.flatnonzero(np.diff(tree["ancestors"][depth - 1], prepend=-1))
+
+
+def rollup(values, tree, depth):
+    if depth == len(LEVEL_COLUMNS) or not len(values):
+        return values
+    return np.add.reduceat(values, node_starts(tree, depth), axis=0)
+
+
+def selected_nodes(tree, category):
+    # Nodes at the breakdown level that sit under every category picked so far
+    first_leaf = node_starts(tree, category["depth"])
+    keep = np.ones(len(first_leaf), dtype=bool)
+    for level, label in enumerate(category["path"]):
+        keep &= tree["ancestors"][level][first_leaf] == tree["labels"][level].get_loc(label)
+    return keep
+
+
+def day_number(date):
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+
+def period_days(aggregates, period):
+    # The picked [start, end] dates as a [first, last) range of stored day numbers
+    first = aggregates["first_day"]
+    stop = first + aggregates["days"]["rows"].shape[1] - 1
+    start = first if period is None else min(max(day_number(period["start"]), first), stop)
+    end = stop if period is None else min(max(day_number(period["end"]) + 1, start), stop)
+    return start, end
+
+
+def observed_days(aggregates):
+    # First and last day with a listing in any category, the bounds of the date range picker
+    days = np.flatnonzero(np.diff(aggregates["days"]["rows"].sum(axis=0)))
+    if not len(days):
+        return None
+    first = aggregates["first_day"]
+    return [pd.Timestamp(np.datetime64(int(first + day), "D")).date() for day in (days[0], days[-1])]
+
+
+def day_buckets(days, key):
+    # The same calendar buckets ingest derives from each timestamp, for whole days
+    dates = pd.DatetimeIndex(days.astype("datetime64[D]"))
+    if key == "total":
+        return np.zeros(len(days), dtype=np.int64)
+    if key == "weeks":
+        return (days + EPOCH_WEEKDAY) // 7 - (days[0] + EPOCH_WEEKDAY) // 7 if len(days) else days
+    if key == "week":
+        return dates.isocalendar().week.to_numpy(dtype=np.int64)
+    if key == "week_of_month":
+        return dates.month.to_numpy().astype(np.int64) * BUCKET_SIZES[key] + dates.day.to_numpy() // 7 + 1
+    if key == "weekday":
+        return dates.weekday.to_numpy().astype(np.int64)
+    return getattr(dates, key).to_numpy().astype(np.int64)
+
+
+def period_hours(aggregates, period):
+    # Hours are kept per calendar month, so the range widens to the months it touches
+    prefix = aggregates["month_hours"]
+    first = aggregates["first_month"]
+    n_months = prefix["rows"].shape[1] - 1
+    start, end = period_days(aggregates, period)
+    if end <= start:
+        return {name: np.zeros_like(values[:, 0]) for name, values in prefix.items()}
+    low = int(np.datetime64(start, "D").astype("datetime64[M]").astype(np.int64)) - first
+    high = int(np.datetime64(end - 1, "D").astype("datetime64[M]").astype(np.int64)) + 1 - first
+    low, high = min(max(low, 0), n_months), min(max(high, 0), n_months)
+    return {name: values[:, high] - values[:, low] for name, values in prefix.items()}
+
+
+def period_arrays(aggregates, key, period):
+    if key == "hour":
+        return period_hours(aggregates, period)
+
+    # Consecutive days in the same bucket form one run, and a run's total is one
+    # subtraction of the prefix sums, so a month costs the same as a single day
+    start, end = period_days(aggregates, period)
+    days = np.arange(start, end)
+    codes = day_buckets(days, key)
+    runs = np.flatnonzero(np.diff(codes, prepend=-1))
+    bounds = np.append(days[runs], end) - aggregates["first_day"]
+
+    if key == "week_of_month":
+        n_buckets = MONTHS * BUCKET_SIZES[key]
+    elif key in BUCKET_SIZES:
+        n_buckets = BUCKET_SIZES[key]
+    else:
+        n_buckets = int(codes.max()) + 1 if len(codes) else 0
+    prefix = aggregates["days"]
+    n_leaves = prefix["rows"].shape[0]
+    flat = (np.arange(n_leaves)[:, None] * n_buckets + codes[runs]).ravel()
+    arrays = {
+        name: np.bincount(flat, weights=np.diff(values[:, bounds], axis=1).ravel(), minlength=n_leaves * n_buckets)
+        .astype(values.dtype).reshape(n_leaves, n_buckets)
+        for name, values in prefix.items()
+    }
+    if key == "week_of_month":
+        arrays = {name: values.reshape(n_leaves, MONTHS, BUCKET_SIZES[key]) for name, values in arrays.items()}
+    return arrays
+
+
+def _select(aggregates, key, category, month, period=None):
+    category = category or {"depth": 1, "path": []}
+    arrays = aggregates[key] if period is None and key in aggregates else period_arrays(aggregates, key, period)
+    if key == "week_of_month":
+        if month == "All":
+            arrays = {name: values.sum(axis=1) for name, values in arrays.items()}
+        else:
+            arrays = {name: values[:, month] for name, values in arrays.items()}
+    tree = aggregates["tree"]
+    arrays = {name: rollup(values, tree, category["depth"]) for name, values in arrays.items()}
+    if category["path"]:
+        keep = selected_nodes(tree, category)
+        arrays = {name: np.where(keep[:, None], values, 0) for name, values in arrays.items()}
+    return arrays
+
+
+def observed_buckets(aggregates, key, category=None, period=None):
+    rows = _select(aggregates, key, category, "All", period)["rows"]
+    return np.flatnonzero(rows.sum(axis=0))
+
+
+def observed_categories(aggregates, path=()):
+    # Children of the picked path that have listings, for the drill-down selectors
+    category = {"depth": len(path) + 1, "path": list(path)}
+    rows = _select(aggregates, "month", category, "All")["rows"].sum(axis=1)
+    return list(aggregates["tree"]["labels"][len(path)][rows > 0])
+
+
+def week_series(aggregates, category=None, period=None):
+    # Wide frame: one zero-filled revenue column per category, one row per consecutive week
+    depth = category["depth"] if category else 1
+    arrays = _select(aggregates, "weeks", category, "All", period)
+    observed = np.flatnonzero(arrays["rows"].sum(axis=1))
+    n_weeks = arrays["rows"].shape[1]
+    first = aggregates["first_week"] if period is None else (period_days(aggregates, period)[0] + EPOCH_WEEKDAY) // 7
+    return pd.DataFrame(
+        arrays["revenue"][observed].T,
+        index=pd.Index(week_starts(first + np.arange(n_weeks)), name="week_start"),
+        columns=pd.Index(aggregates["tree"]["labels"][depth - 1][observed], name=LEVEL_COLUMNS[depth - 1]),
+    )
+
+
+def granularity_table(aggregates, key, category=None, month="All", period=None):
+    depth = category["depth"] if category else 1
+    arrays = _select(aggregates, key, category, month, period)
+
+    # Only cells that saw rows, in (category, bucket) order like a sorted groupby
+    node_index, buckets = np.nonzero(arrays["rows"])
+    return pd.DataFrame({
+        LEVEL_COLUMNS[depth - 1]: pd.Categorical.from_codes(node_index, categories=aggregates["tree"]["labels"][depth - 1]),
+        key: buckets,
+        "revenue": arrays["revenue"][node_index, buckets],
+        "listings": arrays["listings"][node_index, buckets],
+    })
+
+
+def category_totals(aggregates, category=None, period=None):
+    # Each category's total over the range is one subtraction of its running totals
+    depth = category["depth"] if category else 1
+    arrays = _select(aggregates, "total", category, "All", period)
+    node_index = np.flatnonzero(arrays["rows"][:, 0])
+    return pd.DataFrame({
+        LEVEL_COLUMNS[depth - 1]: pd.Categorical.from_codes(node_index, categories=aggregates["tree"]["labels"][depth - 1]),
+        "revenue": arrays["revenue"][node_index, 0],
+        "listings": arrays["listings"][node_index, 0],
+    })
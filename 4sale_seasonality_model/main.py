@@ -1,8 +1,18 @@
-import streamlit as st
-import pandas as pd
-import gdown
 import os
+
+import pandas as pd
+import streamlit as st
 from streamlit_option_menu import option_menu
+import info
+from cache import CACHE_DIR, QUARANTINE_PATH
+from categories import category_selector, selected_level_1
+from data_processing import memory_report
+from dataset import get_dataset, get_precomputed, precomputed_dir, session_view
+from index_engine import use_precomputed
+from periods import period_selector
+from profiling import PROFILE_DEFAULT, append_log, begin_run, end_run, stage
+from sketches import USER_COUNTS
+from sources import describe_source
 
 # Set up the page
 st.set_page_config(page_title="4sale Seasonality Analysis", page_icon=":bar_chart:", initial_sidebar_state="expanded")
@@ -21,101 +31,136 @@ with st.sidebar:
         default_index=0,
     )
 
-# Sidebar filters (conditionally rendered after data is loaded)
-if "final_data" in st.session_state:
-    level_1_options = st.session_state.final_data["Level-1"].unique()
-    selected_level_1 = st.sidebar.selectbox("Select Level-1 Category", options=["All"] + list(level_1_options))
+# Every rerun's stages are appended here while the Performance panel is on
+PERFORMANCE_LOG = os.environ.get("SEASONALITY_PROFILE_LOG", os.path.join(CACHE_DIR, "performance.jsonl"))
+
+# Stage timings are only collected while the Performance panel is on
+show_performance = st.sidebar.checkbox("Performance panel", value=PROFILE_DEFAULT, key="performance_panel")
+begin_run(show_performance)
+
+# Load the shared dataset (built once per server process, reused by every session)
+serving_dir = precomputed_dir()
+try:
+    with stage("load dataset"):
+        if serving_dir:
+            dataset = get_precomputed(serving_dir)
+            use_precomputed(dataset)
+        else:
+            with st.spinner(f"Data is being processed from {describe_source()}, please wait."):
+                progress_bars = {}
+
+                def show_download_progress(state):
+                    for name, (done, total) in state.items():
+                        if name not in progress_bars:
+                            progress_bars[name] = st.progress(0.0)
+                        fraction = min(done / total, 1.0) if total else 0.0
+                        size = f"{done / 2**20:,.1f} of {total / 2**20:,.1f} MB" if total else f"{done / 2**20:,.1f} MB"
+                        progress_bars[name].progress(fraction, text=f"Downloading {name}: {size}")
+
+                dataset = get_dataset(show_download_progress)
+                for bar in progress_bars.values():
+                    bar.empty()
+except Exception as e:
+    st.error(f"Error reading the files: {e}")
+    st.stop()
+
+load_stats = dataset["stats"]
+if load_stats["mode"] == "precomputed":
+    st.sidebar.caption(
+        f"Data: {load_stats['rows']:,} rows, precomputed results from {load_stats['created']} "
+        f"loaded in {load_stats['seconds']:.2f}s."
+    )
+elif load_stats["mode"] == "shared":
+    st.sidebar.caption(f"Data: {load_stats['rows']:,} rows, mapped from the shared dataset in {load_stats['seconds']:.2f}s.")
+elif load_stats["mode"] == "cached":
+    st.sidebar.caption(f"Data: {load_stats['rows']:,} rows, loaded from cache in {load_stats['seconds']:.2f}s.")
+elif load_stats["mode"] == "incremental":
+    st.sidebar.caption(
+        f"Data: {load_stats['rows']:,} rows, {load_stats['new_rows']:,} new rows from {describe_source()} "
+        f"appended in {load_stats['seconds']:.1f}s."
+    )
 else:
-    st.sidebar.warning("Data is being processed from Google Drive, please wait.")
-
-# Check if data exists in session state
-if 'final_data' not in st.session_state:
-    # Google Drive file links
-    transactions_url = "https://drive.google.com/uc?id=14h_94INBkzAxLqopeNbZOCVkWMQktAAb"
-    listings_url = "https://docs.google.com/spreadsheets/d/165EmqELxzDlWrCjGE-yjxd-SlkMmHx9VdWBFrn3T78s/export?format=csv&id=165EmqELxzDlWrCjGE-yjxd-SlkMmHx9VdWBFrn3T78s"
-
-    # Download files from Google Drive
-    gdown.download(transactions_url, "transactions.csv", quiet=False)
-    gdown.download(listings_url, "listingsCategories.csv", quiet=False)
-
-    # Check if files are downloaded successfully
-if os.path.exists("transactions.csv"):
-    try:
-        # Read the CSV file for transactions in chunks
-        chunksize = 10000  # Adjust chunk size based on your needs
-        for chunk in pd.read_csv("transactions.csv", encoding='utf-8', chunksize=chunksize, header=0, on_bad_lines='skip', delimiter=',', quotechar='"'):
-            # Print columns to debug
-        
-
-            # Clean and process the chunk
-            chunk.columns = chunk.columns.str.strip()  # Strip any leading/trailing whitespace from columns
-            if "CATEGORY_ID" not in chunk.columns:
-                st.error("'CATEGORY_ID' column not found in transactions file.")
-                st.stop()
-
-            # Rename CATEGORY_ID to CAT_ID
-            chunk = chunk.rename(columns={"CATEGORY_ID": "CAT_ID"})
-
-            # Process listings data
-            listings = pd.read_csv("listingsCategories.csv", encoding='utf-8', delimiter=',', quotechar='"', on_bad_lines='skip')
-
-            # Check columns in listings file to ensure FULL_PATH exists
-           
-            if "FULL_PATH" not in listings.columns:
-                st.error("'FULL_PATH' column not found in listings file.")
-                st.stop()
-
-            # Extract 'Level-1' from 'FULL_PATH' in listings file
-            listings["Level-1"] = listings["FULL_PATH"].str.split(" --_-- ").str[0]
-
-            # Merge the chunk with the listings data on 'CAT_ID'
-            chunk = chunk.merge(listings[["CAT_ID", "Level-1"]], on="CAT_ID", how="left")
-
-            # Append the chunk to the final data
-            if 'final_data' not in locals():
-                final_data = chunk
-            else:
-                final_data = pd.concat([final_data, chunk], ignore_index=True)
-
-        # Save final_data to session state
-        st.session_state.final_data = final_data
-
-        # Success message after processing data
-        st.success("Data loaded from Google Drive and processed successfully! You can now proceed to analysis.")
-    except Exception as e:
-        st.error(f"Error reading the files: {e}")
-        st.stop()
+    st.sidebar.caption(
+        f"Data: {load_stats['rows']:,} rows from {describe_source()}, "
+        f"ingested in {load_stats['seconds']:.1f}s ({load_stats['rows_per_second']:,.0f} rows/s)."
+    )
+    # Every cold ingest reports what the declared schema saved; the out-of-core backend keeps no frame
+    if "bytes_after" in load_stats:
+        st.sidebar.caption(memory_report(load_stats["bytes_before"], load_stats["bytes_after"], load_stats["memory_baseline"]))
+
+bad_rows = load_stats["bad_rows"]
+if bad_rows:
+    quarantined = f" They are kept in {QUARANTINE_PATH}." if os.path.exists(QUARANTINE_PATH) else ""
+    st.sidebar.warning(f"{sum(bad_rows.values()):,} rows could not be parsed and were dropped at load.{quarantined}")
+    st.sidebar.dataframe(
+        pd.DataFrame({"error": list(bad_rows), "rows": list(bad_rows.values())}).sort_values("rows", ascending=False),
+        hide_index=True,
+    )
+
+# Precomputed results and the out-of-core backend carry no row-level frame, only the tables built from it
+final_data = None if dataset.get("final_data") is None else session_view(dataset["final_data"])
+
+cube = dataset["cube"]
+aggregates = dataset["aggregates"]
+
+# Sidebar filters: drill from Level-1 into Level-2 and Level-3 through the category tree
+category = category_selector(aggregates)
+# Date range and year-over-year comparison, answered from the per-category running totals
+period = period_selector(aggregates)
+sketches = dataset["sketches"]
+exact_users = USER_COUNTS != "approximate"
 
 # Navigation options
 if selected == "Insights":
     import insights
-    insights.run(st.session_state.final_data)
+    with stage("insights: yearly totals"):
+        yearly_totals = session_view(dataset["yearly_totals"]) if final_data is None else info.calculate_yearly_totals(final_data, exact_users)
+    with stage("insights: approximate users"):
+        yearly_totals = info.add_user_estimates(yearly_totals, sketches, ["year"])
+    insights.run(yearly_totals, cube, aggregates, period)
     
 elif selected == "Info":
-    import info
-    info.run(st.session_state.final_data)
+    with stage("info: calculate_summary"):
+        summary = session_view(dataset["summary"]) if final_data is None else info.calculate_summary(final_data, exact_users)
+    with stage("info: approximate users"):
+        summary = info.add_user_estimates(summary, sketches, ["year", "month"])
+    info.run(summary, sketches, selected_level_1(category), final_data, dataset.get("partitions"))
 
 elif selected == "Monthly Analysis":
     import monthly
-    monthly.run(st.session_state.final_data, selected_level_1)
+    monthly.run(aggregates, category, period)
 
 elif selected == "Weekly Analysis":
     import weekly
-    weekly.run(st.session_state.final_data, selected_level_1)
+    weekly.run(aggregates, category, period)
 
 elif selected == "Daily Analysis":
     import daily
-    daily.run(st.session_state.final_data, selected_level_1)
+    daily.run(aggregates, category, period)
 
 elif selected == "Weekly in Month Analysis":
     import weekly_month
-    weekly_month.run(st.session_state.final_data, selected_level_1)
+    weekly_month.run(aggregates, category, period)
 
 elif selected == "Hourly Analysis":
     import hourly
-    hourly.run(st.session_state.final_data, selected_level_1)
+    hourly.run(aggregates, category, period)
 
 elif selected == "Weekday Analysis":
     import weekday
-    weekday.run(st.session_state.final_data, selected_level_1)
-
+    weekday.run(aggregates, category, period)
+
+if show_performance:
+    records = end_run()
+    append_log(PERFORMANCE_LOG, selected, records)
+    with st.sidebar.expander("Performance", expanded=True):
+        st.dataframe(pd.DataFrame([
+            {
+                "stage": "  " * record["depth"] + record["stage"],
+                "wall s": record["wall_seconds"],
+                "cpu s": record["cpu_seconds"],
+                "RSS Δ MB": record["rss_delta_mb"],
+            }
+            for record in records
+        ]), hide_index=True)
+        st.caption(f"Appended to {PERFORMANCE_LOG}")
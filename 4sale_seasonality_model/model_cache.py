@@ -0,0 +1,104 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from cache import CACHE_DIR, replace_file
+
+MODEL_CACHE_DIR = os.path.join(CACHE_DIR, "models")
+
+# Size cap for the fitted-model cache; least recently used results go first
+MODEL_CACHE_MAX_BYTES = int(os.environ.get("SEASONALITY_MODEL_CACHE_MB", "64")) * 2**20
+
+# Last fitted parameters per category, one small file per granularity; outside the
+# eviction above, since refits after a data refresh start from them
+PARAMS_DIR = os.path.join(MODEL_CACHE_DIR, "params")
+
+
+def model_key(values, order, granularity, steps, refit):
+    # The refit mode changes the fitted parameters, so each mode keeps its own results
+    digest = hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    digest.update(repr((tuple(order), granularity, steps, refit)).encode())
+    return digest.hexdigest()
+
+
+def series_digest(values):
+    # Identifies the exact input of a stored batch forecast, whatever the fit settings
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+def model_path(key):
+    return os.path.join(MODEL_CACHE_DIR, f"{key}.pkl")
+
+
+def read_model(key):
+    path = model_path(key)
+    try:
+        with open(path, "rb") as handle:
+            result = pickle.load(handle)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+    # Touch on read so eviction follows last use rather than creation; another process may
+    # have evicted the file since it was loaded, which leaves the loaded result valid
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return result
+
+
+def write_model(key, result):
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+
+    def write(tmp):
+        with open(tmp, "wb") as handle:
+            pickle.dump(result, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    replace_file(model_path(key), write)
+    evict()
+
+
+def params_path(granularity):
+    return os.path.join(PARAMS_DIR, f"{granularity}.pkl")
+
+
+def read_params(granularity, order):
+    try:
+        with open(params_path(granularity), "rb") as handle:
+            stored = pickle.load(handle)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+    return stored["params"] if stored["order"] == tuple(order) else {}
+
+
+def write_params(granularity, order, params):
+    # Merged into the stored ones, so categories this fit did not cover keep theirs
+    stored = read_params(granularity, order)
+    stored.update(params)
+    os.makedirs(PARAMS_DIR, exist_ok=True)
+
+    def write(tmp):
+        with open(tmp, "wb") as handle:
+            pickle.dump({"order": tuple(order), "params": stored}, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    replace_file(params_path(granularity), write)
+
+
+def evict(max_bytes=MODEL_CACHE_MAX_BYTES):
+    entries = []
+    for entry in os.scandir(MODEL_CACHE_DIR):
+        if entry.name.endswith(".pkl"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
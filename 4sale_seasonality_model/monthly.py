@@ -1,114 +1,63 @@
-import pandas as pd
 import streamlit as st
-import seaborn as sns
-import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
+import charts
+from kernel import category_column, granularity_table
+from index_engine import engine_selector, seasonality_index
+from periods import show_year_over_year
+from profiling import stage
+from seasonality import revenue_growth
 
 
-def run(final_data, selected_level_1):
+def run(aggregates, category, period=None):
     st.header("Monthly Seasonality Analysis")
+    engine = engine_selector()
 
     try:
-        # Ensure 'TIMESTAMP' is properly formatted
-        final_data["TIMESTAMP"] = pd.to_datetime(
-            final_data["TIMESTAMP"], errors="coerce"
-        )
-        if final_data["TIMESTAMP"].isnull().any():
-            st.warning("Some rows have invalid timestamps and were coerced to NaT.")
+        # Listing revenue per category and month, filtered to the selected categories
+        with stage("monthly: aggregate"):
+            monthly_data = granularity_table(aggregates, "month", category, period=period)
+        column = category_column(monthly_data)
 
-        final_data["month"] = final_data["TIMESTAMP"].dt.month
-        final_data["Level-1"] = (
-            final_data["Level-1"].str.replace("--_--", "").str.strip()
-        )
-
-        # Filter for specific transaction type
-        final_data = final_data[final_data["TRANSACTION_TYPE"] == "Listing"]
-
-        # Filter by selected level-1
-        if selected_level_1 != "All":
-            final_data = final_data[final_data["Level-1"] == selected_level_1]
-
-
-        if final_data.empty:
+        if monthly_data.empty:
             st.warning(
-                "No data available after filtering. Please check the selected Level-1 and transaction type."
+                "No data available after filtering. Please check the selected categories and transaction type."
             )
             return
 
-        # Group by Level-1 and Month for monthly data
-        st.write("Grouping data by Level-1 and month...")
-        monthly_data = (
-            final_data.groupby(["Level-1", "month"])
-            .agg(revenue=("PRICE", "sum"), listings=("TRANSCATION_ID", "count"))
-            .reset_index()
-        )
-
+        st.write(f"Grouping data by {column} and month...")
 
-        # Create seasonality index using ARIMA
-        monthly_data["revenue_index"] = 0
-        for level in monthly_data["Level-1"].unique():
-            series = monthly_data[monthly_data["Level-1"] == level]["revenue"].fillna(0)
-
-            try:
-                model = ARIMA(series, order=(1, 1, 1))
-                model_fit = model.fit()
-                forecast = model_fit.fittedvalues
-                forecast.iloc[0] = series.iloc[0]
-                forecast_mean = forecast.mean()
-
-                if forecast_mean > 1e-6:
-                    monthly_data.loc[
-                        monthly_data["Level-1"] == level, "revenue_index"
-                    ] = (forecast / forecast_mean)
-                else:
-                    monthly_data.loc[
-                        monthly_data["Level-1"] == level, "revenue_index"
-                    ] = 1
-            except Exception as e:
-                st.warning(f"ARIMA failed for Level-1: {level} due to {e}")
-                monthly_data.loc[monthly_data["Level-1"] == level, "revenue_index"] = 1
+        # Create seasonality index (ARIMA or the fast vectorized engine)
+        with stage("monthly: seasonality index"):
+            monthly_data["revenue_index"] = seasonality_index(monthly_data, "month", "monthly", engine)
 
         # Add percentage change for growth analysis
-        monthly_data["growth%"] = (
-            monthly_data.groupby("Level-1")["revenue"].pct_change().fillna(0) * 100
-        )
+        monthly_data["growth%"] = revenue_growth(monthly_data)
 
         # Colorize based on growth percentage
         def colorize(val):
             color = "green" if val > 0 else "red"
             return f"background-color: {color}; color: white"
 
-        styled_df = monthly_data.style.applymap(colorize, subset=["growth%"])
-        st.write("Processed Monthly Seasonality Data")
-        st.dataframe(styled_df)
+        with stage("monthly: style table"):
+            styled_df = monthly_data.style.applymap(colorize, subset=["growth%"])
+            st.write("Processed Monthly Seasonality Data")
+            st.dataframe(styled_df)
 
         # Generate heatmap for seasonality index
         st.write("Generating heatmap for seasonality index...")
-        heatmap_data = monthly_data.pivot(
-            index="Level-1", columns="month", values="revenue_index"
-        )
-        heatmap_data = heatmap_data.fillna(0)
-        plt.figure(figsize=(12, 6))
-        sns.heatmap(
-            heatmap_data,
-            annot=True,
-            fmt=".2f",
-            cmap="coolwarm",
-            cbar_kws={"label": "Seasonality Index"},
-        )
-        plt.title("Monthly Seasonality by Level-1")
-        st.pyplot(plt)
+        with stage("monthly: heatmap"):
+            heatmap_data = monthly_data.pivot(
+                index=column, columns="month", values="revenue_index"
+            )
+            heatmap_data = heatmap_data.fillna(0)
+            charts.heatmap(heatmap_data, title=f"Monthly Seasonality by {column}", cbar_label="Seasonality Index")
 
         # Bar plot for monthly revenue
         st.write("Generating bar plot for monthly revenue...")
-        month_bar = monthly_data.groupby("month")["revenue"].sum()
-        plt.figure(figsize=(10, 6))
-        month_bar.plot(kind="bar", color="skyblue")
-        plt.title("Revenue by Month")
-        plt.xlabel("Month")
-        plt.ylabel("Total Revenue")
-        plt.xticks(rotation=45)
-        st.pyplot(plt)
+        with stage("monthly: bar chart"):
+            month_bar = monthly_data.groupby("month")["revenue"].sum()
+            charts.bar_chart(month_bar, "Revenue by Month", "Month", "Total Revenue")
+
+        show_year_over_year(aggregates, "month", category, period)
 
     except Exception as e:
         st.error(f"An error occurred: {e}")
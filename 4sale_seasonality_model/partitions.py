@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Canonical row order: every (TRANSACTION_TYPE, Level-1) pair is one contiguous run in
+# time order, so a selection is a slice of the frame rather than a boolean mask over it
+PARTITION_KEYS = ["TRANSACTION_TYPE", "Level-1"]
+
+
+def partition_codes(final_data):
+    # One mixed-radix code over PARTITION_KEYS, the first key most significant. Missing
+    # categories (code -1) get their own partition ahead of the known ones.
+    codes = np.zeros(len(final_data), dtype=np.int64)
+    for key in PARTITION_KEYS:
+        column = final_data[key].cat
+        codes = codes * (len(column.categories) + 1) + column.codes.to_numpy().astype(np.int64) + 1
+    return codes
+
+
+def is_partitioned(final_data):
+    keys = partition_codes(final_data)
+    times = final_data["TIMESTAMP"].to_numpy()
+    step = np.diff(keys)
+    return bool((step >= 0).all() and (times[1:] >= times[:-1])[step == 0].all())
+
+
+def sort_partitions(final_data):
+    if is_partitioned(final_data):
+        return final_data
+    order = np.lexsort((final_data["TIMESTAMP"].to_numpy().view(np.int64), partition_codes(final_data)))
+    return final_data.take(order).reset_index(drop=True)
+
+
+def partition_index(final_data):
+    # Offsets in CSR form: partition k holds rows offsets[k]:offsets[k + 1]
+    index = {key: final_data[key].cat.categories for key in PARTITION_KEYS}
+    counts = np.bincount(partition_codes(final_data), minlength=np.prod([len(index[key]) + 1 for key in PARTITION_KEYS]))
+    index["offsets"] = np.concatenate([[0], np.cumsum(counts)])
+    return index
+
+
+def category_code(categories, value):
+    position = categories.get_indexer([value])[0]
+    return None if position < 0 else position + 1
+
+
+def partition_slices(index, transaction_type=None, selected_level_1="All"):
+    n_levels = len(index["Level-1"]) + 1
+    offsets = index["offsets"]
+    if transaction_type is None:
+        types = range(len(index["TRANSACTION_TYPE"]) + 1)
+    else:
+        code = category_code(index["TRANSACTION_TYPE"], transaction_type)
+        types = [] if code is None else [code]
+
+    if selected_level_1 == "All":
+        levels = range(n_levels)
+    else:
+        code = category_code(index["Level-1"], selected_level_1)
+        levels = [] if code is None else [code]
+    return [(offsets[t * n_levels + level], offsets[t * n_levels + level + 1]) for t in types for level in levels]
+
+
+def select_rows(final_data, index, transaction_type=None, selected_level_1="All", start=None, end=None):
+    # Timestamps are sorted within each partition, so a [start, end) range is two binary searches
+    times = final_data["TIMESTAMP"].to_numpy()
+    slices = []
+    for first, last in partition_slices(index, transaction_type, selected_level_1):
+        if start is not None:
+            first += np.searchsorted(times[first:last], np.datetime64(start, "ns"))
+        if end is not None:
+            last = first + np.searchsorted(times[first:last], np.datetime64(end, "ns"))
+        if last <= first:
+            continue
+        # Neighbouring runs join into one slice, so "All" without a time range is a single view
+        if slices and slices[-1][1] == first:
+            slices[-1] = (slices[-1][0], last)
+        else:
+            slices.append((first, last))
+
+    # One run comes back as a view; only a selection spread over several runs is copied
+    if len(slices) == 1:
+        return final_data.iloc[slices[0][0]:slices[0][1]]
+    if not slices:
+        return final_data.iloc[0:0]
+    return pd.concat([final_data.iloc[first:last] for first, last in slices])
+
+
+def month_bounds(start, end):
+    # Inclusive (year, month) periods as a [start, end) timestamp range
+    first = pd.Timestamp(year=start[0], month=start[1], day=1)
+    return first, pd.Timestamp(year=end[0], month=end[1], day=1) + pd.offsets.MonthBegin(1)
@@ -0,0 +1,52 @@
+import pandas as pd
+import streamlit as st
+
+from kernel import category_column, category_totals, granularity_table, observed_days
+from seasonality import year_over_year
+
+
+def period_selector(aggregates):
+    bounds = observed_days(aggregates)
+    if bounds is None or bounds[0] == bounds[1]:
+        return None
+    first, last = bounds
+
+    # Every position of the slider is answered from the running totals, never from the rows
+    start, end = st.sidebar.slider(
+        "Date range", min_value=first, max_value=last, value=(first, last), format="YYYY-MM-DD", key="period_range"
+    )
+    yoy = st.sidebar.checkbox("Compare with the year before", key="period_yoy")
+
+    # The whole history without a comparison is served from the stored tables, as before
+    if (start, end) == (first, last) and not yoy:
+        return None
+    return {"start": start, "end": end, "yoy": yoy}
+
+
+def previous_year(period):
+    shift = pd.DateOffset(years=1)
+    return dict(period, start=(pd.Timestamp(period["start"]) - shift).date(), end=(pd.Timestamp(period["end"]) - shift).date())
+
+
+def describe_period(period):
+    return f"{period['start']:%Y-%m-%d} to {period['end']:%Y-%m-%d}"
+
+
+def show_year_over_year(aggregates, key, category, period, month="All"):
+    if period is None or not period["yoy"]:
+        return
+    prior = previous_year(period)
+    st.subheader("Year over Year")
+    st.caption(f"{describe_period(period)} against {describe_period(prior)}")
+
+    # Per-category totals: one subtraction of the running totals for each side
+    totals = category_totals(aggregates, category, period)
+    totals = year_over_year(totals, category_totals(aggregates, category, prior), [category_column(totals)])
+    st.dataframe(totals, hide_index=True)
+
+    current = granularity_table(aggregates, key, category, month, period)
+    comparison = year_over_year(
+        current, granularity_table(aggregates, key, category, month, prior), [category_column(current), key]
+    )
+    st.dataframe(comparison, hide_index=True)
+    st.bar_chart(comparison.groupby(key)[["revenue", "revenue_prior_year"]].sum())
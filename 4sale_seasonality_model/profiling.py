@@ -0,0 +1,67 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Turns the sidebar Performance panel on by default
+PROFILE_DEFAULT = os.environ.get("SEASONALITY_PROFILE", "0") == "1"
+
+# Streamlit runs every session's rerun on its own thread, so records never mix across sessions
+_local = threading.local()
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No procfs: fall back to the process high-water mark (kilobytes on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def begin_run(enabled):
+    _local.records = [] if enabled else None
+    _local.depth = 0
+
+
+def end_run():
+    records = getattr(_local, "records", None)
+    _local.records = None
+    return records or []
+
+
+@contextmanager
+def stage(name):
+    records = getattr(_local, "records", None)
+    if records is None:
+        # Disabled, or outside the app (batch, benchmark): a single attribute lookup
+        yield
+        return
+
+    record = {"stage": name, "depth": _local.depth}
+    records.append(record)
+    _local.depth += 1
+    rss = current_rss()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["wall_seconds"] = time.perf_counter() - start
+        # Process CPU time: the ARIMA pool workers and other sessions' threads are not separated out
+        record["cpu_seconds"] = time.process_time() - cpu
+        record["rss_delta_mb"] = (current_rss() - rss) / 2**20
+        _local.depth -= 1
+
+
+def append_log(path, page, records):
+    if not records:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    run = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+    with open(path, "a") as handle:
+        for record in records:
+            handle.write(json.dumps(dict(record, run=run, page=page)) + "\n")
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from kernel import category_column
+
+
+def to_matrix(data, key, value="revenue"):
+    # Category x bucket grid; cells without rows stay NaN
+    rows, levels = pd.factorize(data[category_column(data)], sort=True)
+    columns, buckets = pd.factorize(data[key], sort=True)
+    matrix = np.full((len(levels), len(buckets)), np.nan)
+    matrix[rows, columns] = data[value].to_numpy(dtype=np.float64)
+    return matrix, rows, columns
+
+
+def normalize_rows(matrix):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return matrix / np.nanmean(matrix, axis=1, keepdims=True)
+
+
+def ratio_to_mean(matrix):
+    return normalize_rows(matrix)
+
+
+def centered_moving_average(matrix, window):
+    # Row-wise running mean through cumulative sums; edges average what is available
+    values = np.nan_to_num(matrix)
+    counts = (~np.isnan(matrix)).astype(np.float64)
+    before = window // 2
+    after = window - before - 1
+    pad = ((0, 0), (before + 1, after))
+    value_sums = np.cumsum(np.pad(values, pad), axis=1)
+    count_sums = np.cumsum(np.pad(counts, pad), axis=1)
+    width = matrix.shape[1]
+    window_values = value_sums[:, window:window + width] - value_sums[:, :width]
+    window_counts = count_sums[:, window:window + width] - count_sums[:, :width]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return window_values / window_counts
+
+
+def ratio_to_cma(matrix, window=3):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return normalize_rows(matrix / centered_moving_average(matrix, window))
+
+
+def multiplicative_index(matrix, period=None, window=None):
+    width = matrix.shape[1]
+    period = period or width
+    window = window or min(period, width)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        detrended = matrix / centered_moving_average(matrix, window)
+
+    # Average each phase across cycles, then scale the seasonal factors to mean 1
+    cycles = -(-width // period)
+    padded = np.full((matrix.shape[0], cycles * period), np.nan)
+    padded[:, :width] = detrended
+    seasonal = normalize_rows(np.nanmean(padded.reshape(matrix.shape[0], cycles, period), axis=1))
+    return np.tile(seasonal, cycles)[:, :width]
+
+
+def additive_decomposition(matrix, period):
+    # seasonal_decompose(model="additive") for every row at once: a centered moving
+    # average trend (2 x period for an even period), then the mean detrended value per phase
+    if period % 2:
+        weights = np.ones(period) / period
+    else:
+        weights = np.r_[0.5, np.ones(period - 1), 0.5] / period
+    half = len(weights) // 2
+    width = matrix.shape[1]
+    trend = np.full(matrix.shape, np.nan)
+    trend[:, half:width - half] = np.lib.stride_tricks.sliding_window_view(matrix, len(weights), axis=1) @ weights
+
+    detrended = matrix - trend
+    phases = np.stack([np.nanmean(detrended[:, phase::period], axis=1) for phase in range(period)], axis=1)
+    phases -= phases.mean(axis=1, keepdims=True)
+    seasonal = np.tile(phases, -(-width // period))[:, :width]
+    return trend, seasonal, detrended - seasonal
+
+
+FAST_METHODS = {
+    "Ratio to mean": ratio_to_mean,
+    "Ratio to moving average": ratio_to_cma,
+    "Multiplicative decomposition": multiplicative_index,
+}
+
+
+def fast_revenue_index(data, key, method="Ratio to mean"):
+    matrix, rows, columns = to_matrix(data, key)
+    index = FAST_METHODS[method](matrix)
+
+    # Categories with no revenue at all fall back to 1, like the ARIMA path
+    index = np.where(np.isfinite(index), index, 1.0)
+    return pd.Series(index[rows, columns], index=data.index)
+
+
+def revenue_growth(data):
+    # Month over month change in revenue within each category
+    return data.groupby(category_column(data), observed=True)["revenue"].pct_change().fillna(0) * 100
+
+
+def index_growth(revenue_index):
+    return revenue_index.apply(lambda x: round((x - 1) * 100, 2))
+
+
+def year_over_year(current, prior, keys):
+    # Outer join, so a bucket seen in only one of the two years still shows, with zeros on the other side
+    merged = current.merge(prior, on=keys, how="outer", suffixes=("", "_prior_year"), sort=True)
+    for column in ("revenue", "listings"):
+        merged[column] = merged[column].fillna(0)
+        merged[f"{column}_prior_year"] = merged[f"{column}_prior_year"].fillna(0)
+    merged = merged.astype({"listings": np.int64, "listings_prior_year": np.int64})
+    prior_revenue = merged["revenue_prior_year"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        merged["yoy%"] = np.where(prior_revenue > 0, (merged["revenue"].to_numpy() / prior_revenue - 1) * 100, np.nan)
+    return merged
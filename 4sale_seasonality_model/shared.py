@@ -0,0 +1,137 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from cache import CACHE_DIR, READER_SETTINGS, replace_file
+from sketches import PRECISION, USER_COUNTS
+from warehouse import BACKEND
+
+# Publish the loaded dataset as one memory-mapped Arrow file that every server process
+# maps read-only, instead of each process holding its own copy
+SHARED = os.environ.get("SEASONALITY_SHARED", "1") != "0"
+SHARED_DIR = os.path.join(CACHE_DIR, "shared")
+
+# Bump whenever the file layout changes so stale files are ignored
+SHARED_VERSION = "1"
+
+SKELETON_KEY = b"seasonality.skeleton"
+
+# Fixed-width dtypes are stored as Arrow columns; anything else stays in the pickled skeleton
+FIXED_KINDS = "biufmM"
+
+ARRAY = "__shared_array__"
+FRAME = "__shared_frame__"
+CATEGORICAL = "__shared_categorical__"
+MASKED = "__shared_masked__"
+
+
+def generation(key):
+    # The same sources give a different dataset under another backend or user count setting
+    settings = [key, SHARED_VERSION, BACKEND, USER_COUNTS, PRECISION, READER_SETTINGS]
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def shared_path(key):
+    return os.path.join(SHARED_DIR, f"dataset-{generation(key)}.arrow")
+
+
+def stash_array(values, columns):
+    # Flattened to one Arrow array; booleans go in as bytes because Arrow packs them into bits
+    flat = np.ascontiguousarray(values).reshape(-1)
+    name = f"a{len(columns)}"
+    columns[name] = pa.array(flat.view(np.uint8) if flat.dtype == np.bool_ else flat)
+    return {ARRAY: name, "dtype": flat.dtype.str, "shape": values.shape}
+
+
+def stash_column(series, columns):
+    # Codes instead of a dictionary array: a missing category is code -1, not an Arrow null that
+    # would make the read copy the column. NaN prices stay plain float values for the same reason.
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return {CATEGORICAL: stash_array(series.cat.codes.to_numpy(), columns), "dtype": series.dtype}
+    if isinstance(series.array, pd.arrays.IntegerArray):
+        # Nullable ids: the values and the missing-value mask as two plain arrays
+        values = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+        return {MASKED: stash_array(values, columns), "mask": stash_array(series.isna().to_numpy(), columns)}
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in FIXED_KINDS:
+        return stash_array(series.to_numpy(), columns)
+    return series.to_numpy()
+
+
+def stash(value, columns):
+    if isinstance(value, dict):
+        return {name: stash(item, columns) for name, item in value.items()}
+    if isinstance(value, list):
+        return [stash(item, columns) for item in value]
+    if isinstance(value, np.ndarray) and value.dtype.kind in FIXED_KINDS:
+        return stash_array(value, columns)
+    if isinstance(value, pd.DataFrame) and value.index.equals(pd.RangeIndex(len(value))) and value.columns.is_unique:
+        return {FRAME: [(name, stash_column(value[name], columns)) for name in value.columns], "rows": len(value)}
+    return value
+
+
+def publish(dataset, key):
+    # One row, one list column per array: every column's values sit in a single aligned buffer
+    columns = {}
+    skeleton = stash(dataset, columns)
+    table = pa.table({
+        name: pa.LargeListArray.from_arrays(pa.array([0, len(values)], pa.int64()), values)
+        for name, values in columns.items()
+    })
+    table = table.replace_schema_metadata({SKELETON_KEY: pickle.dumps(skeleton, protocol=pickle.HIGHEST_PROTOCOL)})
+
+    def write(tmp):
+        # Uncompressed, so the mapped pages are the column data itself
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    path = shared_path(key)
+    replace_file(path, write)
+    # Processes still serving an older file keep their mapping; unlinking only drops the name
+    for stale in glob.glob(os.path.join(SHARED_DIR, "dataset-*.arrow")):
+        if stale != path:
+            os.remove(stale)
+
+
+def mapped_array(table, marker):
+    values = table.column(marker[ARRAY]).chunk(0).values.to_numpy(zero_copy_only=True)
+    return values.view(np.dtype(marker["dtype"])).reshape(marker["shape"])
+
+
+def restore(value, table):
+    if isinstance(value, dict):
+        if ARRAY in value:
+            return mapped_array(table, value)
+        if MASKED in value:
+            return pd.arrays.IntegerArray(mapped_array(table, value[MASKED]), mapped_array(table, value["mask"]))
+        if CATEGORICAL in value:
+            return pd.Categorical.from_codes(mapped_array(table, value[CATEGORICAL]), dtype=value["dtype"], validate=False)
+        if FRAME in value:
+            # copy=False keeps one block per column, each a view on the mapping
+            return pd.DataFrame(
+                {name: restore(column, table) for name, column in value[FRAME]},
+                index=pd.RangeIndex(value["rows"]), copy=False,
+            )
+        return {name: restore(item, table) for name, item in value.items()}
+    if isinstance(value, list):
+        return [restore(item, table) for item in value]
+    return value
+
+
+def open_published(key):
+    start = time.perf_counter()
+    try:
+        # The arrays keep a reference to the mapping, so it stays open as long as the dataset does
+        table = pa.ipc.open_file(pa.memory_map(shared_path(key), "r")).read_all()
+        dataset = restore(pickle.loads(table.schema.metadata[SKELETON_KEY]), table)
+    except (OSError, KeyError, pa.ArrowException, pickle.UnpicklingError):
+        return None
+    dataset["stats"] = dict(dataset["stats"], mode="shared", seconds=time.perf_counter() - start)
+    return dataset
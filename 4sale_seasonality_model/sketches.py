@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# HyperLogLog registers per sketch are 2**precision bytes; the relative standard
+# error of a distinct count is about 1.04 / sqrt(2**precision), 1.6% at 12
+PRECISION = int(os.environ.get("SEASONALITY_HLL_PRECISION", "12"))
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+# "exact" shows the nunique counts only, "approximate" replaces them with the sketch
+# estimates, "both" shows the estimates next to the exact counts for validation
+USER_COUNTS = os.environ.get("SEASONALITY_USER_COUNTS", "both")
+
+# One sketch per cell; yearly and range counts merge these instead of rescanning rows
+SKETCH_KEYS = ["year", "month", "Level-1"]
+
+
+def check_precision(precision):
+    if not MIN_PRECISION <= precision <= MAX_PRECISION:
+        raise ValueError(f"HyperLogLog precision must be between {MIN_PRECISION} and {MAX_PRECISION}, got {precision}.")
+    return precision
+
+
+def standard_error(precision):
+    return 1.04 / np.sqrt(2 ** precision)
+
+
+def bit_length(values):
+    # Exact over all 64 bits, unlike log2 on a float
+    length = np.zeros(values.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >> np.uint64(shift)
+        found = high != 0
+        length += found.view(np.uint8) * np.uint8(shift)
+        values = np.where(found, high, values)
+    return length + (values != 0).view(np.uint8)
+
+
+def register_ranks(hashes, precision):
+    # The top bits pick the register, the position of the first set bit after them is the rank
+    bits = 64 - precision
+    registers = (hashes >> np.uint64(bits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << bits) - 1)
+    return registers, (bits + 1 - bit_length(rest)).astype(np.uint8)
+
+
+def group_codes(keys, by):
+    # The key space (years x months x categories) is small, so a dense remap beats sorting rows
+    codes = np.zeros(len(keys), dtype=np.int64)
+    uniques = []
+    for column in by:
+        column_codes, column_uniques = pd.factorize(keys[column], sort=True, use_na_sentinel=False)
+        codes = codes * len(column_uniques) + column_codes
+        uniques.append(column_uniques)
+    sizes = [len(column_uniques) for column_uniques in uniques]
+    present = np.flatnonzero(np.bincount(codes, minlength=int(np.prod(sizes))))
+    remap = np.zeros(int(np.prod(sizes)), dtype=np.int64)
+    remap[present] = np.arange(len(present))
+    positions = np.unravel_index(present, sizes)
+    groups = pd.DataFrame({
+        column: np.asarray(column_uniques)[position] for column, column_uniques, position in zip(by, uniques, positions)
+    })
+    return remap[codes], groups
+
+
+def empty_sketches(precision, hash_name):
+    return {
+        "precision": precision,
+        "hash": hash_name,
+        "keys": pd.DataFrame(columns=SKETCH_KEYS),
+        "registers": np.zeros((0, 2 ** precision), dtype=np.uint8),
+    }
+
+
+def build_sketches(final_data, precision=PRECISION):
+    precision = check_precision(precision)
+    users = final_data.loc[final_data["USER_ID"].notna(), SKETCH_KEYS + ["USER_ID"]]
+    if not len(users):
+        return empty_sketches(precision, "pandas")
+
+    # Cast first: a part with missing ids stores them as floats, and 7.0 must hash like 7
+    hashes = pd.util.hash_array(users["USER_ID"].to_numpy().astype(np.int64))
+    registers, ranks = register_ranks(hashes, precision)
+    codes, keys = group_codes(users, SKETCH_KEYS)
+
+    sketches = np.zeros((len(keys), 2 ** precision), dtype=np.uint8)
+    np.maximum.at(sketches, (codes, registers), ranks)
+    return {"precision": precision, "hash": "pandas", "keys": keys, "registers": sketches}
+
+
+def combine(keys, registers, by):
+    # Registers merge by element-wise max, so any union of cells is one reduce
+    if not len(keys):
+        return keys[by], registers
+    codes, merged_keys = group_codes(keys, by)
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+    return merged_keys, np.maximum.reduceat(registers[order], starts, axis=0)
+
+
+def merge_sketches(sketches, delta):
+    if (sketches["precision"], sketches["hash"]) != (delta["precision"], delta["hash"]):
+        raise ValueError("Cannot merge sketches built with a different precision or hash.")
+    keys, registers = combine(
+        pd.concat([sketches["keys"], delta["keys"]], ignore_index=True),
+        np.concatenate([sketches["registers"], delta["registers"]]),
+        SKETCH_KEYS,
+    )
+    return dict(sketches, keys=keys, registers=registers)
+
+
+def estimate(registers):
+    m = registers.shape[-1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / np.exp2(-registers.astype(np.float64)).sum(axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    # Linear counting is far more accurate while many registers are still empty
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def approximate_users(sketches, by):
+    keys, registers = combine(sketches["keys"], sketches["registers"], by)
+    return keys.assign(approx_users=np.rint(estimate(registers)).astype(np.int64))
+
+
+def period_mask(keys, start, end, selected_level_1="All"):
+    period = keys["year"].astype(np.int64) * 12 + keys["month"].astype(np.int64)
+    mask = (period >= start[0] * 12 + start[1]) & (period <= end[0] * 12 + end[1])
+    if selected_level_1 != "All":
+        mask &= keys["Level-1"] == selected_level_1
+    return mask.to_numpy()
+
+
+def range_users(sketches, start, end, selected_level_1="All"):
+    registers = sketches["registers"][period_mask(sketches["keys"], start, end, selected_level_1)]
+    if not len(registers):
+        return 0
+    return int(np.rint(estimate(registers.max(axis=0))))
@@ -0,0 +1,238 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qs, urlparse
+
+import gdown
+import requests
+
+from cache import file_digest
+
+# Google Drive file links
+TRANSACTIONS_URL = "https://drive.google.com/uc?id=14h_94INBkzAxLqopeNbZOCVkWMQktAAb"
+LISTINGS_URL = "https://docs.google.com/spreadsheets/d/165EmqELxzDlWrCjGE-yjxd-SlkMmHx9VdWBFrn3T78s/export?format=csv&id=165EmqELxzDlWrCjGE-yjxd-SlkMmHx9VdWBFrn3T78s"
+
+TRANSACTIONS_FILE = "transactions.csv"
+LISTINGS_FILE = "listingsCategories.csv"
+
+# Point this at a directory holding both CSVs to run without Google Drive
+SOURCE_DIR_ENV = "SEASONALITY_SOURCE_DIR"
+
+# Or at a base URL serving both CSVs by file name (a mirror, or a local stand-in server)
+SOURCE_URL_ENV = "SEASONALITY_SOURCE_URL"
+
+# Where downloaded sources and their .meta.json records are kept
+DOWNLOAD_DIR = os.environ.get("SEASONALITY_DOWNLOAD_DIR", ".")
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+
+# How often the caller's progress callback is refreshed while downloads run
+PROGRESS_INTERVAL = 0.25
+
+
+def source_dir():
+    return os.environ.get(SOURCE_DIR_ENV)
+
+
+def source_url():
+    return os.environ.get(SOURCE_URL_ENV)
+
+
+def describe_source():
+    directory = source_dir()
+    if directory:
+        return f"local folder {directory}"
+    return source_url() or "Google Drive"
+
+
+def drive_download_url(url):
+    # uc?id= answers large files with a virus-scan page; this endpoint streams them directly
+    parsed = urlparse(url)
+    file_id = parse_qs(parsed.query).get("id")
+    if parsed.netloc == "drive.google.com" and file_id:
+        return f"https://drive.usercontent.google.com/download?id={file_id[0]}&export=download&confirm=t"
+    return url
+
+
+def source_urls():
+    base = source_url()
+    if base:
+        return {name: f"{base.rstrip('/')}/{name}" for name in (TRANSACTIONS_FILE, LISTINGS_FILE)}
+    return {TRANSACTIONS_FILE: drive_download_url(TRANSACTIONS_URL), LISTINGS_FILE: LISTINGS_URL}
+
+
+def meta_path(path):
+    return path + ".meta.json"
+
+
+def read_meta(path):
+    try:
+        with open(meta_path(path)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_meta(path, meta):
+    tmp = meta_path(path) + ".tmp"
+    with open(tmp, "w") as handle:
+        json.dump(meta, handle)
+    os.replace(tmp, meta_path(path))
+
+
+def remove_meta(path):
+    if os.path.exists(meta_path(path)):
+        os.remove(meta_path(path))
+
+
+def server_md5(response):
+    # Google sends "X-Goog-Hash: crc32c=...,md5=...", other servers Content-MD5; both base64
+    for part in response.headers.get("X-Goog-Hash", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name == "md5":
+            return value
+    return response.headers.get("Content-MD5")
+
+
+def md5_base64(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode()
+
+
+def local_copy_intact(path, meta):
+    # file_digest is memoized on size and mtime, and the dataset key needs it anyway
+    return os.path.exists(path) and meta.get("sha256") is not None and file_digest(path) == meta["sha256"]
+
+
+def finish_download(url, path, response_headers):
+    meta = {
+        "url": url,
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "size": os.path.getsize(path),
+        # Hashed here, in the download thread, while the other source may still be arriving
+        "sha256": file_digest(path),
+    }
+    write_meta(path, meta)
+    return meta
+
+
+def fetch_file(url, path, progress=None):
+    meta = read_meta(path)
+    headers = {}
+    if meta.get("url") == url and local_copy_intact(path, meta):
+        # Conditional request: an unchanged source answers 304 and is not downloaded again
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    # Resume an interrupted download, but only if the server still has the same version
+    partial = path + ".part"
+    partial_meta = read_meta(partial)
+    offset = os.path.getsize(partial) if os.path.exists(partial) and partial_meta.get("url") == url else 0
+    validator = partial_meta.get("etag") or partial_meta.get("last_modified")
+    if offset and validator:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 304:
+            if progress:
+                progress(meta["size"], meta["size"])
+            return path, "unchanged"
+        response.raise_for_status()
+
+        if response.headers.get("Content-Type", "").startswith("text/html"):
+            # Drive answered with an interstitial page instead of the file; let gdown negotiate it
+            response.close()
+            gdown.download(url, path, quiet=True)
+            finish_download(url, path, {})
+            return path, "downloaded"
+
+        resumed = response.status_code == 206
+        offset = offset if resumed else 0
+        length = response.headers.get("Content-Length")
+        total = offset + int(length) if length else None
+        write_meta(partial, {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        })
+
+        done = offset
+        with open(partial, "ab" if resumed else "wb") as handle:
+            for block in response.iter_content(CHUNK_SIZE):
+                handle.write(block)
+                done += len(block)
+                if progress:
+                    progress(done, total)
+
+    size = os.path.getsize(partial)
+    if total is not None and size != total:
+        raise IOError(f"Incomplete download of {url}: {size:,} of {total:,} bytes; it resumes on the next fetch.")
+
+    # A server hash covers the whole object, so it also checks a resumed file end to end
+    expected = server_md5(response)
+    if expected and md5_base64(partial) != expected:
+        os.remove(partial)
+        remove_meta(partial)
+        raise ValueError(f"Checksum mismatch for {url}; the partial download was discarded.")
+
+    os.replace(partial, path)
+    remove_meta(partial)
+    finish_download(url, path, response.headers)
+    return path, "resumed" if resumed else "downloaded"
+
+
+def iter_sources(progress=None):
+    # Yields (name, path) as each source lands, so the caller can start on the small
+    # listings file while the transactions are still downloading
+    directory = source_dir()
+    if directory:
+        for name in (TRANSACTIONS_FILE, LISTINGS_FILE):
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Source file not found: {path}")
+            yield name, path
+        return
+
+    urls = source_urls()
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    state = {name: (0, None) for name in urls}
+
+    def track(name):
+        def update(done, total):
+            state[name] = (done, total)
+        return update
+
+    # Both sources download at once; progress is reported back on the caller's thread,
+    # which is the only one allowed to update Streamlit elements
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        futures = {
+            executor.submit(fetch_file, url, os.path.join(DOWNLOAD_DIR, name), track(name)): name
+            for name, url in urls.items()
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            if progress:
+                progress(dict(state))
+            for future in done:
+                path, status = future.result()
+                logger.info("%s: %s", futures[future], status)
+                yield futures[future], path
+
+
+def fetch_sources(progress=None):
+    paths = dict(iter_sources(progress))
+    return paths[TRANSACTIONS_FILE], paths[LISTINGS_FILE]
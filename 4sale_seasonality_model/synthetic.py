@@ -0,0 +1,97 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_processing import LEVEL_SEPARATOR
+from sources import LISTINGS_FILE, TRANSACTIONS_FILE
+
+# Benchmark presets, selectable by name on the command line
+SIZES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000, "50m": 50_000_000}
+
+LEVEL_1 = ["Cars", "Property", "Electronics", "Jobs", "Services", "Furniture", "Animals", "Fashion"]
+TRANSACTION_TYPES = ["Listing", "Refund", "Bump"]
+TRANSACTION_WEIGHTS = [0.8, 0.1, 0.1]
+
+# Rows generated and appended to the CSV at a time, so 50M rows never sit in memory at once
+WRITE_CHUNK = 1_000_000
+
+START = np.datetime64("2021-01-01T00:00:00")
+YEARS = 3
+
+# Relative traffic per month and hour, so every page has a seasonality to find
+MONTH_WEIGHTS = np.array([0.8, 0.75, 0.9, 1.0, 1.0, 0.85, 0.7, 0.75, 1.0, 1.3, 1.35, 1.1])
+HOUR_WEIGHTS = np.concatenate([np.full(7, 0.2), np.full(5, 1.0), np.full(6, 1.3), np.full(6, 0.9)])
+
+
+def listings_frame(subcategories=4, leaves=3):
+    rows = []
+    for level_1 in LEVEL_1:
+        for sub in range(subcategories):
+            for leaf in range(leaves):
+                path = LEVEL_SEPARATOR.join([level_1, f"{level_1} {sub + 1}", f"{level_1} {sub + 1}.{leaf + 1}"])
+                rows.append((len(rows) + 1, path))
+    return pd.DataFrame(rows, columns=["CAT_ID", "FULL_PATH"])
+
+
+def timestamps(rng, size):
+    # Day, hour and second drawn separately, days weighted by their month
+    days = np.arange(YEARS * 365)
+    months = (START + days.astype("timedelta64[D]")).astype("datetime64[M]").astype(np.int64) % 12
+    day_weights = MONTH_WEIGHTS[months] / MONTH_WEIGHTS[months].sum()
+    day = rng.choice(days, size=size, p=day_weights)
+    hour = rng.choice(24, size=size, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    second = rng.integers(0, 3600, size=size)
+    values = START + (day * 86400 + hour * 3600 + second).astype("timedelta64[s]")
+    return np.char.replace(np.datetime_as_string(values, unit="s"), "T", " ")
+
+
+def transactions_chunk(rng, first_id, size, categories):
+    # About 1% of rows point at a category missing from the listings file, like the real export
+    category_ids = rng.choice(categories, size=size)
+    unknown = rng.random(size) < 0.01
+    category_ids[unknown] = categories.max() + 1 + rng.integers(0, 10, size=unknown.sum())
+    scale = 5.0 + (category_ids % len(LEVEL_1)) * 3.0
+    return pd.DataFrame({
+        "TRANSCATION_ID": np.arange(first_id, first_id + size),
+        "USER_ID": rng.integers(1, max(size // 4, 1000), size=size),
+        "CATEGORY_ID": category_ids,
+        "PRICE": np.round(rng.gamma(2.0, scale, size=size), 2),
+        "TIMESTAMP": timestamps(rng, size),
+        "TRANSACTION_TYPE": rng.choice(TRANSACTION_TYPES, size=size, p=TRANSACTION_WEIGHTS),
+    })
+
+
+def generate(rows, directory, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    listings = listings_frame()
+    listings.to_csv(os.path.join(directory, LISTINGS_FILE), index=False)
+
+    categories = listings["CAT_ID"].to_numpy()
+    transactions_path = os.path.join(directory, TRANSACTIONS_FILE)
+    for first in range(0, rows, WRITE_CHUNK):
+        chunk = transactions_chunk(rng, first + 1, min(WRITE_CHUNK, rows - first), categories)
+        chunk.to_csv(transactions_path, index=False, mode="w" if first == 0 else "a", header=first == 0)
+    return transactions_path, os.path.join(directory, LISTINGS_FILE)
+
+
+def parse_rows(value):
+    return SIZES[value.lower()] if value.lower() in SIZES else int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic transactions and listings CSVs.")
+    parser.add_argument("--rows", type=parse_rows, default="100k",
+                        help=f"number of transactions, or one of {', '.join(SIZES)}")
+    parser.add_argument("--output-dir", required=True, help="folder the two CSVs are written to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    transactions_path, listings_path = generate(args.rows, args.output_dir, args.seed)
+    print(f"Wrote {args.rows:,} transactions to {transactions_path} and categories to {listings_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import json
+
+import pandas as pd
+
+from cache import past_watermark, watermark
+from data_processing import narrow_integer
+
+
+def test_watermark_skips_missing_ids():
+    final_data = pd.DataFrame({
+        "TIMESTAMP": pd.to_datetime(["2022-01-01 10:00", "2022-01-02 12:00", "2022-01-02 12:00", "2022-01-02 12:00"]),
+        "TRANSCATION_ID": narrow_integer(pd.Series([1, 2, None, 3])),
+    })
+    assert str(final_data["TRANSCATION_ID"].dtype) == "UInt8"
+
+    latest, ids = watermark(final_data)
+    assert ids == [2, 3]
+    manifest = json.loads(json.dumps({"watermark": latest, "watermark_ids": ids}))
+
+    rows = pd.DataFrame({
+        "TIMESTAMP": pd.to_datetime(["2022-01-02 12:00", "2022-01-02 12:00", "2022-01-03 09:00"]),
+        "TRANSCATION_ID": narrow_integer(pd.Series([2, 4, 5])),
+    })
+    assert past_watermark(rows, manifest)["TRANSCATION_ID"].tolist() == [4, 5]
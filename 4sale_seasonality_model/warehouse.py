@@ -0,0 +1,337 @@
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache import CACHE_DIR, load_dataset, replace_file, source_key
+from categories import build_category_tree
+from cube import CUBE_KEYS
+from data_processing import FIELD_COUNT_ERROR, build_level1_lookup, load_listings
+from kernel import BUCKET_SIZES, EPOCH_WEEKDAY, MONTHS, prefix_sums
+from sketches import PRECISION, SKETCH_KEYS, USER_COUNTS, check_precision, empty_sketches, group_codes
+
+# "duckdb" keeps the enriched rows on disk and only materializes aggregates in pandas
+BACKEND = os.environ.get("SEASONALITY_BACKEND", "pandas")
+
+WAREHOUSE_DIR = os.path.join(CACHE_DIR, "warehouse")
+PARTITIONS_DIR = os.path.join(WAREHOUSE_DIR, "transactions")
+
+# Bump whenever the partition layout or the stored aggregates change
+WAREHOUSE_VERSION = "6"
+
+# DuckDB spills to disk past this, so ingest never needs the whole export in RAM
+MEMORY_LIMIT = os.environ.get("SEASONALITY_DUCKDB_MEMORY", "2GB")
+
+# Source column -> SQL type; unparseable values become NULL like pd.to_numeric(errors="coerce")
+SOURCE_TYPES = {
+    "TRANSCATION_ID": "BIGINT",
+    "USER_ID": "BIGINT",
+    "CATEGORY_ID": "BIGINT",
+    "PRICE": "DOUBLE",
+    "TIMESTAMP": "TIMESTAMP",
+    "TRANSACTION_TYPE": "VARCHAR",
+}
+
+# Rows without a valid timestamp land in the year=0/month=0 partition, which every scan prunes
+CALENDAR_SQL = {
+    "year": "coalesce(year(TIMESTAMP), 0)",
+    "month": "coalesce(month(TIMESTAMP), 0)",
+    "iso_year": "isoyear(TIMESTAMP)",
+    "week": "weekofyear(TIMESTAMP)",
+    "day": "day(TIMESTAMP)",
+    "week_of_month": "day(TIMESTAMP) // 7 + 1",
+    "weekday": "isodow(TIMESTAMP) - 1",
+    "hour": "hour(TIMESTAMP)",
+}
+
+
+def connect():
+    # Optional dependency: only the duckdb backend needs it
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute(f"SET memory_limit = {literal(MEMORY_LIMIT)}")
+    con.execute(f"SET temp_directory = {literal(os.path.join(WAREHOUSE_DIR, 'spill'))}")
+    con.execute("SET preserve_insertion_order = false")
+    return con
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def source_columns(transactions_path):
+    # pandas strips header whitespace, so map the stripped names back to the raw ones
+    header = pd.read_csv(transactions_path, nrows=0, encoding="utf-8")
+    columns = {column.strip(): column for column in header.columns}
+    if "CATEGORY_ID" not in columns:
+        raise ValueError("'CATEGORY_ID' column not found in transactions file.")
+    return columns
+
+
+def scan(directory=PARTITIONS_DIR, valid=True):
+    files = f"read_parquet({literal(os.path.join(directory, '**', '*.parquet'))}, hive_partitioning = true)"
+    return f"(SELECT * FROM {files} WHERE year > 0)" if valid else files
+
+
+def write_partitions(con, transactions_path, listings, directory):
+    lookup, levels = build_level1_lookup(listings)
+    cat_ids = np.flatnonzero(lookup >= 0)
+    level_map = pd.DataFrame({"CAT_ID": cat_ids, "Level-1": levels[lookup[cat_ids]]})
+    con.register("level_map", level_map)
+
+    columns = source_columns(transactions_path)
+    typed = ", ".join(
+        f"TRY_CAST({quote(columns[name])} AS {sql_type}) AS {quote(name)}"
+        for name, sql_type in SOURCE_TYPES.items() if name in columns
+    )
+    calendar = ", ".join(f"{expression} AS {name}" for name, expression in CALENDAR_SQL.items())
+
+    # One streaming pass over the CSV: parse, map Level-1 and write year/month partitions
+    con.execute(f"""
+        COPY (
+            SELECT typed.TRANSCATION_ID, typed.USER_ID, typed.CATEGORY_ID AS CAT_ID, typed.PRICE,
+                   typed.TIMESTAMP, typed.TRANSACTION_TYPE, level_map."Level-1", {calendar}
+            FROM (
+                SELECT {typed}
+                FROM read_csv({literal(transactions_path)}, header = true, all_varchar = true, store_rejects = true)
+            ) AS typed
+            LEFT JOIN level_map ON typed.CATEGORY_ID = level_map.CAT_ID
+        ) TO {literal(directory)} (FORMAT parquet, PARTITION_BY (year, month))
+    """)
+    rows, invalid_timestamps = con.execute(
+        f"SELECT count(*) FILTER (WHERE year > 0), count(*) FILTER (WHERE year = 0) FROM {scan(directory, valid=False)}"
+    ).fetchone()
+    # Lines the reader skipped, one count per line however many of its fields were wrong,
+    # under the same labels as the arrow reader's quarantine
+    rejected = con.execute(f"""
+        SELECT CASE WHEN error_type IN ('TOO MANY COLUMNS', 'MISSING COLUMNS') THEN {literal(FIELD_COUNT_ERROR)}
+                    ELSE lower(error_type) END AS error,
+               count(DISTINCT (scan_id, line))
+        FROM reject_errors GROUP BY error
+    """).fetchall()
+    return pd.Index(sorted(levels)), rows, invalid_timestamps, row_errors(dict(rejected), invalid_timestamps)
+
+
+def query_aggregates(con, tree, source):
+    # Cells per leaf category, like kernel.aggregate_listings; the join drops unknown categories
+    leaves = tree["codes"][-1]
+    cat_ids = np.flatnonzero(leaves >= 0)
+    con.register("leaf_map", pd.DataFrame({"CAT_ID": cat_ids, "leaf": leaves[cat_ids].astype(np.int64)}))
+    n_leaves = len(tree["labels"][-1])
+
+    aggregates = {"tree": tree}
+    listings = f"FROM {source} JOIN leaf_map USING (CAT_ID) WHERE TRANSACTION_TYPE = 'Listing'"
+    for key, n_buckets in BUCKET_SIZES.items():
+        keys = f"month, {key}" if key == "week_of_month" else key
+        cells = con.execute(f"""
+            SELECT leaf, {keys}, sum(PRICE), count(TRANSCATION_ID), count(*)
+            {listings} GROUP BY ALL
+        """).df()
+        shape = (n_leaves, MONTHS, n_buckets) if key == "week_of_month" else (n_leaves, n_buckets)
+        index = (cells["leaf"].to_numpy(dtype=np.int64),) + tuple(
+            cells[column].to_numpy(dtype=np.int64) for column in keys.split(", ")
+        )
+        arrays = {
+            "revenue": np.zeros(shape),
+            "listings": np.zeros(shape, dtype=np.int64),
+            "rows": np.zeros(shape, dtype=np.int64),
+        }
+        for name, column in zip(arrays, cells.columns[-3:]):
+            arrays[name][index] = cells[column].fillna(0).to_numpy()
+        aggregates[key] = arrays
+
+    # Same numbering as kernel.week_numbers, so the continuous weekly series line up
+    aggregates["weeks"], aggregates["first_week"] = query_span(
+        con, listings, n_leaves, f"(datediff('day', DATE '1970-01-01', TIMESTAMP) + {EPOCH_WEEKDAY}) // 7"
+    )
+
+    # Running totals per day and per calendar month and hour, like kernel.aggregate_listings
+    days, aggregates["first_day"] = query_span(con, listings, n_leaves, "datediff('day', DATE '1970-01-01', TIMESTAMP)")
+    aggregates["days"] = prefix_sums(days)
+    month_hours, aggregates["first_month"] = query_span(
+        con, listings, n_leaves, "(year - 1970) * 12 + month - 1", "hour", BUCKET_SIZES["hour"]
+    )
+    aggregates["month_hours"] = prefix_sums(month_hours)
+    return aggregates
+
+
+def query_span(con, listings, n_leaves, position, bucket=None, n_buckets=1):
+    # Dense cells from the first to the last position, like kernel.accumulate_span
+    keys = "" if bucket is None else f", {bucket}"
+    cells = con.execute(f"""
+        SELECT leaf, {position} AS position{keys}, sum(PRICE), count(TRANSCATION_ID), count(*)
+        {listings} GROUP BY ALL
+    """).df()
+    positions = cells["position"].to_numpy(dtype=np.int64)
+    first = int(positions.min()) if len(positions) else 0
+    shape = (n_leaves, int(positions.max()) - first + 1 if len(positions) else 0)
+    index = (cells["leaf"].to_numpy(dtype=np.int64), positions - first)
+    if bucket is not None:
+        shape += (n_buckets,)
+        index += (cells[bucket].to_numpy(dtype=np.int64),)
+    arrays = {
+        "revenue": np.zeros(shape),
+        "listings": np.zeros(shape, dtype=np.int64),
+        "rows": np.zeros(shape, dtype=np.int64),
+    }
+    for name, column in zip(arrays, cells.columns[-3:]):
+        arrays[name][index] = cells[column].fillna(0).to_numpy()
+    return arrays, first
+
+
+def query_cube(con, levels, source):
+    keys = ", ".join(quote(key) for key in CUBE_KEYS)
+    not_null = " AND ".join(f"{quote(key)} IS NOT NULL" for key in CUBE_KEYS)
+    cube = con.execute(f"""
+        SELECT {keys}, coalesce(sum(PRICE), 0) AS revenue, count(TRANSCATION_ID) AS listings
+        FROM {source} WHERE {not_null} GROUP BY ALL
+    """).df()
+    cube["Level-1"] = cube["Level-1"].astype(pd.CategoricalDtype(levels))
+    cube["TRANSACTION_TYPE"] = cube["TRANSACTION_TYPE"].astype("category")
+    return cube
+
+
+def query_totals(con, keys, source, exact_users=True):
+    # Same columns as info.calculate_summary / calculate_yearly_totals, counted by the engine
+    users = ", count(DISTINCT USER_ID) AS total_users" if exact_users else ""
+    return con.execute(f"""
+        SELECT {keys},
+               count(TRANSCATION_ID) AS total_transactions,
+               coalesce(sum(PRICE), 0) AS total_revenue{users}
+        FROM {source} GROUP BY ALL ORDER BY ALL
+    """).df()
+
+
+def query_sketches(con, source, precision=PRECISION):
+    precision = check_precision(precision)
+    bits = 64 - precision
+    keys = ", ".join(quote(key) for key in SKETCH_KEYS)
+
+    # Same registers as sketches.register_ranks, over DuckDB's own hash: the engine only
+    # returns one max rank per (cell, register), never the user ids
+    cells = con.execute(f"""
+        SELECT {keys}, register, max(rank) AS rank
+        FROM (
+            SELECT {keys}, h >> {bits} AS register,
+                   h & {(1 << bits) - 1} AS w0, w0 | (w0 >> 1) AS w1, w1 | (w1 >> 2) AS w2, w2 | (w2 >> 4) AS w3,
+                   w3 | (w3 >> 8) AS w4, w4 | (w4 >> 16) AS w5, w5 | (w5 >> 32) AS w6,
+                   {bits + 1} - bit_count(w6) AS rank
+            FROM (SELECT {keys}, hash(USER_ID) AS h FROM {source} WHERE USER_ID IS NOT NULL)
+        ) GROUP BY ALL
+    """).df()
+    if not len(cells):
+        return empty_sketches(precision, "duckdb")
+
+    codes, sketch_keys = group_codes(cells, SKETCH_KEYS)
+    registers = np.zeros((len(sketch_keys), 2 ** precision), dtype=np.uint8)
+    registers[codes, cells["register"].to_numpy(dtype=np.int64)] = cells["rank"].to_numpy(dtype=np.uint8)
+    return {"precision": precision, "hash": "duckdb", "keys": sketch_keys, "registers": registers}
+
+
+def query_levels(con, source):
+    return [row[0] for row in con.execute(
+        f'SELECT DISTINCT "Level-1" FROM {source} WHERE "Level-1" IS NOT NULL ORDER BY 1'
+    ).fetchall()]
+
+
+def warehouse_path(name):
+    return os.path.join(WAREHOUSE_DIR, name)
+
+
+def read_manifest():
+    try:
+        with open(warehouse_path("manifest.json")) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == WAREHOUSE_VERSION else None
+
+
+def row_errors(rejected, invalid_timestamps):
+    # Bad fields are cast to NULL and kept, so rows are only dropped for their shape or their timestamp
+    errors = {error: int(count) for error, count in rejected.items()}
+    if invalid_timestamps:
+        errors["invalid TIMESTAMP"] = invalid_timestamps
+    return errors
+
+
+def build_warehouse(key, transactions_path, listings_path):
+    start = time.perf_counter()
+    shutil.rmtree(WAREHOUSE_DIR, ignore_errors=True)
+    os.makedirs(WAREHOUSE_DIR)
+
+    listings = load_listings(listings_path)
+    con = connect()
+    try:
+        levels, rows, invalid_timestamps, bad_rows = write_partitions(con, transactions_path, listings, PARTITIONS_DIR)
+        source = scan()
+        results = {
+            "aggregates": query_aggregates(con, build_category_tree(listings), source),
+            "cube": query_cube(con, levels, source),
+            "summary": query_totals(con, "year, month", source, USER_COUNTS != "approximate"),
+            "yearly_totals": query_totals(con, "year", source, USER_COUNTS != "approximate"),
+            "sketches": query_sketches(con, source),
+            "levels": query_levels(con, source),
+        }
+    finally:
+        con.close()
+
+    with open(warehouse_path("results.pkl"), "wb") as handle:
+        pickle.dump(results, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write(tmp):
+        with open(tmp, "w") as handle:
+            json.dump({
+                "version": WAREHOUSE_VERSION, "key": key, "rows": rows, "invalid_timestamps": invalid_timestamps,
+                "bad_rows": bad_rows, "user_counts": USER_COUNTS, "precision": PRECISION,
+            }, handle)
+
+    # Written last: a warehouse without a manifest is rebuilt on the next start
+    replace_file(warehouse_path("manifest.json"), write)
+    elapsed = time.perf_counter() - start
+    return results, {
+        "mode": "full",
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed > 0 else float("inf"),
+        "invalid_timestamps": invalid_timestamps,
+        "bad_rows": bad_rows,
+    }
+
+
+def load_warehouse(transactions_path, listings_path):
+    key = source_key(transactions_path, listings_path)
+    manifest = read_manifest()
+    start = time.perf_counter()
+    # The stored totals and sketches depend on the user count settings as well as the sources
+    settings = {"key": key, "user_counts": USER_COUNTS, "precision": PRECISION}
+    if manifest is not None and all(manifest.get(name) == value for name, value in settings.items()):
+        with open(warehouse_path("results.pkl"), "rb") as handle:
+            results = pickle.load(handle)
+        stats = {
+            "mode": "cached",
+            "rows": manifest["rows"],
+            "seconds": time.perf_counter() - start,
+            "invalid_timestamps": manifest["invalid_timestamps"],
+            "bad_rows": manifest["bad_rows"],
+        }
+    else:
+        results, stats = build_warehouse(key, transactions_path, listings_path)
+
+    # No row-level frame: every page reads the aggregates, the summaries come from the scans
+    return dict(results, final_data=None, stats=dict(stats, key=key))
+
+
+def open_dataset(transactions_path, listings_path):
+    if BACKEND == "duckdb":
+        return load_warehouse(transactions_path, listings_path)
+    return load_dataset(transactions_path, listings_path)
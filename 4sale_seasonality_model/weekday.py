@@ -1,85 +1,51 @@
 import pandas as pd
 import streamlit as st
-import seaborn as sns
-import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
-
-def run(final_data, selected_level_1):
+import charts
+from kernel import category_column, granularity_table
+from index_engine import engine_selector, seasonality_index
+from data_processing import WEEKDAY_NAMES
+from periods import show_year_over_year
+from profiling import stage
+from seasonality import index_growth
+
+def run(aggregates, category, period=None):
     st.header("Weekday Seasonality Analysis")
-    final_data = st.session_state.final_data 
-    final_data["TIMESTAMP"] = pd.to_datetime(final_data["TIMESTAMP"])
-    final_data["weekday"] = final_data["TIMESTAMP"].dt.day_name()  # Extract weekday names
-    final_data["Level-1"] = final_data['Level-1'].str.replace('--_--', '').str.strip()
-    final_data = final_data[final_data['TRANSACTION_TYPE'] == 'Listing']
+    engine = engine_selector()
+    with stage("weekday: aggregate"):
+        weekday_data = granularity_table(aggregates, "weekday", category, period=period)
 
-    if selected_level_1 != "All":
-        final_data = final_data[final_data["Level-1"] == selected_level_1]
+    with stage("weekday: seasonality index"):
+        weekday_data["revenue_index"] = seasonality_index(weekday_data, "weekday", "weekday", engine)
 
-    weekday_data = final_data.groupby(["Level-1", "weekday"]).agg(
-        revenue=("PRICE", "sum"),
-        listings=("TRANSCATION_ID", "count")
-    ).reset_index()
+    # Calculate growth percentage
+    weekday_data["growth%"] = index_growth(weekday_data["revenue_index"])
 
-    weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    weekday_data["weekday"] = pd.Categorical(weekday_data["weekday"], categories=weekday_order, ordered=True)
+    # weekday is stored as 0 (Monday) .. 6 (Sunday); name it only on the aggregated table
+    weekday_data["weekday"] = pd.Categorical.from_codes(weekday_data["weekday"], categories=WEEKDAY_NAMES, ordered=True)
     weekday_data.sort_values("weekday", inplace=True)
 
-    weekday_data["revenue_index"] = 0
-
-
-    for level in weekday_data["Level-1"].unique():
-        series = weekday_data[weekday_data["Level-1"] == level]["revenue"].fillna(0)
-
-        try:
-
-            model = ARIMA(series, order=(1, 1, 1))
-            model_fit = model.fit()
-            forecast = model_fit.fittedvalues
-            forecast.iloc[0] = series.iloc[0]
-            forecast_mean = forecast.mean()
-            if forecast_mean > 1e-6:  # Prevent division by zero
-                weekday_data.loc[
-                    weekday_data["Level-1"] == level, "revenue_index"
-                ] = forecast / forecast_mean
-            else:
-                weekday_data.loc[
-                    weekday_data["Level-1"] == level, "revenue_index"
-                ] = 1
-
-        except Exception as e:
-            st.warning(f"ARIMA failed for Level-1: {level} due to {e}")
-            weekday_data.loc[
-                weekday_data["Level-1"] == level, "revenue_index"
-            ] = 1  # Fallback: Set revenue_index to 1
-
-    # Calculate growth percentage
-    weekday_data["growth%"] = weekday_data["revenue_index"].apply(lambda x: round((x - 1) * 100, 2))
-
     def colorize(val):
         color = 'green' if val > 0 else 'red'
         return f'background-color: {color}; color: white'
 
-    styled_df = weekday_data.style.applymap(colorize, subset=["growth%"])
-    st.write("Processed Weekday Seasonality Data:")
-    st.dataframe(styled_df)
+    with stage("weekday: style table"):
+        styled_df = weekday_data.style.applymap(colorize, subset=["growth%"])
+        st.write("Processed Weekday Seasonality Data:")
+        st.dataframe(styled_df)
 
-    heatmap_data = weekday_data.pivot(index="Level-1", columns="weekday", values="revenue_index")
-    heatmap_data = heatmap_data.fillna(0).astype(float)
+    with stage("weekday: heatmap"):
+        column = category_column(weekday_data)
+        heatmap_data = weekday_data.pivot(index=column, columns="weekday", values="revenue_index")
+        heatmap_data = heatmap_data.fillna(0).astype(float)
 
-    # Plot heatmap
-    plt.figure(figsize=(12, 6))
-    sns.heatmap(heatmap_data, annot=True, fmt=".2f", cmap="coolwarm", cbar_kws={'label': 'Seasonality Index'})
-    plt.title("Weekday Seasonality by Level-1")
-    st.pyplot(plt)
+        # Plot heatmap
+        charts.heatmap(heatmap_data, title=f"Weekday Seasonality by {column}", cbar_label="Seasonality Index")
 
    
-    weekday_bar = weekday_data.groupby('weekday')['revenue'].sum()
+    with stage("weekday: bar chart"):
+        weekday_bar = weekday_data.groupby('weekday')['revenue'].sum()
+
+        # Plot a bar chart
+        charts.bar_chart(weekday_bar, 'Revenue by Weekday', 'Weekday', 'Total Revenue', figsize=(12, 6))
 
-    # Plot a bar chart
-    plt.figure(figsize=(12, 6))
-    weekday_bar.plot(kind='bar', color='skyblue')
-    plt.title('Revenue by Weekday')
-    plt.xlabel('Weekday')
-    plt.ylabel('Total Revenue')
-    plt.xticks(rotation=45)
-    st.pyplot(plt)
+    show_year_over_year(aggregates, "weekday", category, period)
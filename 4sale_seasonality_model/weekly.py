@@ -1,87 +1,86 @@
 import pandas as pd
 import streamlit as st
-import seaborn as sns
-import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
-from statsmodels.tsa.seasonal import seasonal_decompose
+import charts
+from categories import selected_category
+from kernel import category_column, granularity_table, observed_buckets, week_series
+from seasonality import fast_revenue_index, index_growth
+from forecasting import describe_cache, weekly_models
+from index_engine import PRECOMPUTED_CAPTION, stored_weekly_models
+from periods import show_year_over_year
+from profiling import stage
 
-def run(final_data, selected_level_1):
-    st.header("Weekly Seasonality Analysis")
 
-    final_data = st.session_state.final_data 
-    final_data["TIMESTAMP"] = pd.to_datetime(final_data["TIMESTAMP"])
-    final_data["week"] = final_data["TIMESTAMP"].dt.isocalendar().week
-    final_data["Level-1"] = final_data['Level-1'].str.replace('--_--', '').str.strip()
-    final_data = final_data[final_data['TRANSACTION_TYPE'] == 'Listing']
+@st.cache_data(show_spinner=False)
+def _weekly_models(digest, _series):
+    return weekly_models(_series)
 
-    if selected_level_1 != "All":
-        final_data = final_data[final_data["Level-1"] == selected_level_1]
 
-    week_options = final_data["week"].unique()
-    selected_week = st.sidebar.selectbox("Select Week", options=["All"] + sorted(week_options))
+def run(aggregates, category, period=None):
+    st.header("Weekly Seasonality Analysis")
 
-    if selected_week != "All":
-        final_data = final_data[final_data["week"] == selected_week]
+    week_options = observed_buckets(aggregates, "week", category, period)
+    selected_week = st.sidebar.selectbox("Select Week", options=["All"] + list(week_options))
 
-    weekly_data = final_data.groupby(["Level-1", "week"]).agg(
-        revenue=("PRICE", "sum"),
-        listings=("TRANSCATION_ID", "count")
-    ).reset_index()
+    with stage("weekly: aggregate"):
+        weekly_data = granularity_table(aggregates, "week", category, period=period)
+        if selected_week != "All":
+            weekly_data = weekly_data[weekly_data["week"] == selected_week].reset_index(drop=True)
 
-    weekly_data["revenue_index"] = (
-        weekly_data.groupby("Level-1")["revenue"].transform(lambda x: x / x.mean())
-    )
-    weekly_data["growth%"] = weekly_data["revenue_index"].apply(lambda x: round((x - 1) * 100, 2))
+    with stage("weekly: seasonality index"):
+        weekly_data["revenue_index"] = fast_revenue_index(weekly_data, "week", "Ratio to mean")
+    weekly_data["growth%"] = index_growth(weekly_data["revenue_index"])
 
     def colorize(val):
         color = 'green' if val > 0 else 'red'
         return f'background-color: {color}; color: white'
 
-    styled_df = weekly_data.style.applymap(colorize, subset=["growth%"])
-    st.write("Processed Weekly Seasonality Data")
-    st.dataframe(styled_df)
-
-    heatmap_data = weekly_data.pivot(index="Level-1", columns="week", values="revenue_index")
-    plt.figure(figsize=(14, 7))
-    sns.heatmap(heatmap_data, annot=False, cmap="coolwarm")
-    st.pyplot(plt)
-
-    arima_data = weekly_data[weekly_data["Level-1"] == selected_level_1][["week", "revenue"]]
-    arima_data = arima_data.set_index("week")
-
-    if len(arima_data) >= 104:
-        st.write(f"Seasonality Analysis for {selected_level_1}")
-        try:
-            decomposition = seasonal_decompose(arima_data["revenue"], model="additive", period=52)
-            st.write("Seasonal Component")
-            st.line_chart(decomposition.seasonal)
-        except Exception as e:
-            st.error(f"Error during seasonal decomposition: {e}")
+    with stage("weekly: style table"):
+        styled_df = weekly_data.style.applymap(colorize, subset=["growth%"])
+        st.write("Processed Weekly Seasonality Data")
+        st.dataframe(styled_df)
+
+    with stage("weekly: heatmap"):
+        column = category_column(weekly_data)
+        heatmap_data = weekly_data.pivot(index=column, columns="week", values="revenue_index")
+        charts.heatmap(heatmap_data, figsize=(14, 7), annot=False)
+
+    # The models run on the continuous weekly series, not on the week-of-year buckets above,
+    # for every category of the breakdown at once, so picking one of them refits nothing
+    with stage("weekly: series"):
+        series = week_series(aggregates, {"depth": category["depth"], "path": category["path"][:category["depth"] - 1]}, period)
+    with stage("weekly: batched models"):
+        # Served from the batch results when it fitted this very series; fitted live otherwise
+        stored = stored_weekly_models(series, category, period)
+        components, forecasts, report = stored or _weekly_models(charts.frame_digest(series), series)
+    st.caption(PRECOMPUTED_CAPTION if stored else describe_cache(report))
+
+    if components is None:
+        st.warning(
+            f"Not enough data for seasonal decomposition: {len(series)} weeks observed, at least 104 are required."
+        )
+    else:
+        st.write(f"Seasonal Component by {series.columns.name}")
+        st.line_chart(components["seasonal"])
+
+    selected = selected_category(category)
+    if selected in series.columns:
+        st.write(f"Seasonality Analysis for {selected}")
+        parts = {"observed": series[selected]}
+        if components is not None:
+            parts.update({name: part[selected] for name, part in components.items()})
+        st.line_chart(pd.DataFrame(parts))
+        if selected in report["summaries"]:
+            st.write("ARIMA Model Summary")
+            st.text(report["summaries"][selected])
 
-        try:
-            model = ARIMA(arima_data["revenue"], order=(1, 1, 1))
-            arima_result = model.fit()
+    st.write(f"Forecast for Next {len(forecasts)} Weeks")
+    st.dataframe(forecasts)
+    st.line_chart(forecasts)
+    for level, error in report["failures"].items():
+        st.error(f"Error fitting ARIMA model for {level}: {error}")
 
-            st.write("ARIMA Model Summary")
-            st.text(arima_result.summary())
+    with stage("weekly: bar chart"):
+        weekly_bar = weekly_data.groupby('week')['revenue'].sum()
+        charts.bar_chart(weekly_bar, 'Revenue by Week', 'Week', 'Total Revenue')
 
-            forecast = arima_result.forecast(steps=5)
-            st.write("Forecast for Next 5 Weeks")
-            st.line_chart(forecast)
-        except Exception as e:
-            st.error(f"Error fitting ARIMA model: {e}")
-    else:
-        st.warning(
-            "No selected level-1 category or Not enough data for seasonal decomposition or ARIMA analysis. At least 104 observations are required."
-        )
-        st.write("Here are some aggregated insights from the available data:")
-        st.bar_chart(arima_data["revenue"])
-
-    weekly_bar = weekly_data.groupby('week')['revenue'].sum()
-    plt.figure(figsize=(10, 6))
-    weekly_bar.plot(kind='bar', color='skyblue')
-    plt.title('Revenue by Week')
-    plt.xlabel('Week')
-    plt.ylabel('Total Revenue')
-    plt.xticks(rotation=45)
-    st.pyplot(plt)
+    show_year_over_year(aggregates, "week", category, period)